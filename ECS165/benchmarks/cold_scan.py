@@ -0,0 +1,38 @@
+# Cold start of each page store: Database.open followed by a full scan of every column,
+# timed against a database the same store wrote and closed
+import sys
+import time
+
+from benchmarks.common import database_path, open_database
+from lstore.bufferpool import BufferPool
+from lstore.pagestore import FilePageStore, MmapPageStore, SegmentPageStore
+from lstore.query import Query
+
+ROWS = 100000
+COLUMNS = 8
+REPEAT = 3
+
+
+def cold_scan(path, rows):
+    start = time.perf_counter()
+    with open_database(path) as db:
+        query = Query(db.get_table("Scan"))
+        for column in range(COLUMNS):
+            query.sum(0, rows, column)
+        return time.perf_counter() - start
+
+
+def main(rows=ROWS):
+    print("%-18s %10s" % ("store", "seconds"))
+    for store_type in (FilePageStore, MmapPageStore, SegmentPageStore):
+        BufferPool.page_store = store_type()
+        with database_path() as path:
+            with open_database(path) as db:
+                query = Query(db.create_table("Scan", COLUMNS, 0))
+                query.insert_columns(list(range(rows)), *[[i * column for i in range(rows)] for column in range(1, COLUMNS)])
+            seconds = min(cold_scan(path, rows) for _ in range(REPEAT))
+        print("%-18s %10.3f" % (store_type.__name__, seconds))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else ROWS)
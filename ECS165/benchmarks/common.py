@@ -0,0 +1,40 @@
+# Helpers shared by the benchmarks. Run each benchmark from the ECS165 directory,
+# e.g. python -m benchmarks.pool_lookup
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from lstore.db import Database
+
+
+# returns the fastest of repeat timings of fn() in seconds
+def best_of(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+# yields the path of a temporary database directory that is removed afterwards
+@contextmanager
+def database_path():
+    directory = tempfile.mkdtemp()
+    try:
+        yield Path(directory) / "db"
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+# yields an open database at path and closes it afterwards
+@contextmanager
+def open_database(path):
+    db = Database()
+    db.open(path)
+    try:
+        yield db
+    finally:
+        db.close()
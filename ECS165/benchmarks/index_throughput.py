@@ -0,0 +1,38 @@
+# Insert and point lookup throughput of the index types at 1M random keys. Another version
+# of the index module can be timed by naming it, e.g. an older index.py copied to
+# lstore/old_index.py: python -m benchmarks.index_throughput 1000000 lstore.old_index
+import importlib
+import random
+import sys
+import time
+
+# lstore.index imports lstore.table, which has to be imported first
+import lstore.table
+
+KEYS = 1000000
+
+
+def main(keys=KEYS, module_name="lstore.index"):
+    module = importlib.import_module(module_name)
+    random.seed(0)
+    order = list(range(keys))
+    random.shuffle(order)
+    print("%-10s %14s %14s" % ("index", "inserts/s", "lookups/s"))
+    for index_type in (module.BTree, getattr(module, "HashIndex", None)):
+        if index_type is None:
+            continue
+        index = index_type()
+        start = time.perf_counter()
+        for key in order:
+            index.insert_to_tree([key, [key]])
+        insert_seconds = time.perf_counter() - start
+        search_tree = index.search_tree
+        start = time.perf_counter()
+        for key in order:
+            search_tree(key)
+        lookup_seconds = time.perf_counter() - start
+        print("%-10s %14.0f %14.0f" % (index_type.__name__, keys / insert_seconds, keys / lookup_seconds))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else KEYS, *sys.argv[2:3])
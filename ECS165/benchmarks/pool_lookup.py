@@ -0,0 +1,45 @@
+# Random page lookup latency of each buffer pool policy at several pool sizes, next to a
+# linear scan over the frames like the one PrioritizedPool.get_frame did before its frame table
+import random
+import sys
+
+from benchmarks.common import best_of
+from lstore.bufferpool import PinnableBasePage
+from lstore.pool import ClockPool, ClockProPool, LRUPool, TwoQueuePool
+
+SIZES = (100, 10000, 100000)
+LOOKUPS = 20000
+PATH = "table/0"
+
+
+def fill(pool, size):
+    for i in range(size):
+        pool.add_frame(PinnableBasePage(None), (i, 0), PATH, True)
+
+
+def linear_scan(frames, index):
+    for frame in frames:
+        if frame.index == index and frame.page_range_data_path == PATH and frame.is_base:
+            return frame.base_page
+    return None
+
+
+def main(sizes=SIZES):
+    random.seed(0)
+    print("%-14s %8s %14s" % ("pool", "size", "us per lookup"))
+    for size in sizes:
+        indices = [(random.randrange(size), 0) for _ in range(LOOKUPS)]
+        for pool_type in (LRUPool, ClockPool, ClockProPool, TwoQueuePool):
+            pool = pool_type(size)
+            fill(pool, size)
+            seconds = best_of(lambda: [pool.get_frame(index, PATH, True) for index in indices])
+            print("%-14s %8d %14.3f" % (pool_type.__name__, size, seconds / LOOKUPS * 1e6))
+        # the scan is too slow to time every lookup at the larger sizes
+        frames = list(pool)
+        sample = indices[:max(10, LOOKUPS * 100 // size)]
+        seconds = best_of(lambda: [linear_scan(frames, index) for index in sample], repeat=1)
+        print("%-14s %8d %14.3f" % ("linear scan", size, seconds / len(sample) * 1e6))
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or SIZES)
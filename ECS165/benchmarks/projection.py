@@ -0,0 +1,32 @@
+# Query.select of 1 up to all of 50 columns by key, over records of which a third were updated,
+# so both base and tail pages are read
+import sys
+
+from benchmarks.common import best_of, database_path, open_database
+from lstore.query import Query
+
+ROWS = 20000
+COLUMNS = 50
+WIDTHS = (1, 2, 5, 10, 25, 50)
+
+
+def main(rows=ROWS):
+    with database_path() as path, open_database(path) as db:
+        query = Query(db.create_table("Projection", COLUMNS, 0))
+        query.insert_columns(list(range(rows)), *[[key + column for key in range(rows)] for column in range(1, COLUMNS)])
+        for key in range(0, rows, 3):
+            query.update(key, None, *[key] * (COLUMNS - 1))
+
+        print("%-8s %12s" % ("columns", "selects/s"))
+        for width in WIDTHS:
+            query_columns = [1] * width + [0] * (COLUMNS - width)
+
+            def select_all():
+                for key in range(rows):
+                    query.select(key, 0, query_columns)
+
+            print("%-8d %12.0f" % (width, rows / best_of(select_all)))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else ROWS)
@@ -0,0 +1,25 @@
+# Fixtures shared by the tests. Being at the top of ECS165, this file also lets the tests
+# import lstore when pytest is run from this directory.
+import sys
+
+import pytest
+
+from lstore.db import Database
+
+
+# an open database in a temporary directory, closed after the test
+@pytest.fixture
+def db(tmp_path):
+    db = Database()
+    db.open(tmp_path / "db")
+    yield db
+    db.close()
+
+
+# switches threads often so that writers interleave inside the index operations
+@pytest.fixture
+def fast_switching():
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    yield
+    sys.setswitchinterval(interval)
@@ -0,0 +1,73 @@
+from lstore.config import *
+
+
+# Running state of one aggregate over the values it has been fed so far
+class Accumulator:
+
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def add_many(self, values):
+        if not values:
+            return
+        self.total += sum(values)
+        self.count += len(values)
+        low = min(values)
+        high = max(values)
+        if self.min is None or low < self.min:
+            self.min = low
+        if self.max is None or high > self.max:
+            self.max = high
+
+    def add(self, value):
+        self.total += value
+        self.count += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def result(self, function):
+        if function == "sum":
+            return self.total
+        if function == "count":
+            return self.count
+        if function == "min":
+            return self.min
+        if function == "max":
+            return self.max
+        return self.total / self.count
+
+
+AGGREGATE_FUNCTIONS = ("sum", "count", "min", "max", "avg")
+
+
+"""
+# Aggregates column over the records of table whose value in key_column lies in [low, high], a base
+# page at a time. With group_by_column the result is a dict from each value of that column to the
+# aggregate of its records. Returns None if no record matches.
+"""
+
+def aggregate(table, function, column, low, high, key_column, group_by_column=None):
+    assert function in AGGREGATE_FUNCTIONS, \
+        "Unknown aggregate function: " + str(function)
+    if group_by_column is None:
+        accumulator = Accumulator()
+        for values, in table.scan_columns([column], key_column, low, high):
+            accumulator.add_many(values)
+        if accumulator.count == 0:
+            return None
+        return accumulator.result(function)
+    accumulators = {}
+    for values, groups in table.scan_columns([column, group_by_column], key_column, low, high):
+        for value, group in zip(values, groups):
+            accumulator = accumulators.get(group)
+            if accumulator is None:
+                accumulator = accumulators[group] = Accumulator()
+            accumulator.add(value)
+    if not accumulators:
+        return None
+    return {group: accumulator.result(function) for group, accumulator in accumulators.items()}
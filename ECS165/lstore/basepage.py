@@ -1,96 +1,166 @@
 
+from threading import Lock
 from time import time
-from typing import Tuple, Sequence, Iterator
+from typing import Tuple, Sequence, Iterator, List
 
 from lstore.config import *
 from lstore.page import Page
 
 class BasePage:
-    def __init__(self, num_columns):
-        self._pages = []
+    # page_loader(column_indices) -> [Page] loads the given columns from disk. When it is given
+    # the base page starts out empty and columns are only read when they are first used.
+    def __init__(self, num_columns, page_loader=None):
         self.num_columns = num_columns + METADATA_COLUMN_COUNT
-        for i in range(self.num_columns):
-            self._pages.append(Page())
+        self._page_loader = page_loader
+        if page_loader is None:
+            self._pages = [Page() for _ in range(self.num_columns)]
+        else:
+            self._pages = [None] * self.num_columns
+        self._fault_latch = Lock()
         self.is_dirty = False
 
+    def _get_page(self, column_index: int) -> Page:
+        page = self._pages[column_index]
+        if page is None:
+            with self._fault_latch:
+                page = self._pages[column_index]
+                if page is None:
+                    page = self._page_loader([column_index])[0]
+                    self._pages[column_index] = page
+        return page
+
+    # loads the columns that are not resident yet with one page_loader call, so reading
+    # several columns of a cold page costs one read per column group instead of one per column
+    def load_columns(self, column_indices: Sequence[int]) -> None:
+        pages = self._pages
+        missing = [column_index for column_index in column_indices if pages[column_index] is None]
+        if not missing:
+            return
+        with self._fault_latch:
+            missing = [column_index for column_index in dict.fromkeys(missing) if pages[column_index] is None]
+            if missing:
+                for column_index, page in zip(missing, self._page_loader(missing)):
+                    pages[column_index] = page
+
+    def is_resident(self, column_index: int) -> bool:
+        return self._pages[column_index] is not None
+
+    def is_fully_resident(self) -> bool:
+        return all(page is not None for page in self._pages)
+
+    def get_resident_pages(self) -> List[Tuple[int, Page]]:
+        return [(i, page) for i, page in enumerate(self._pages) if page is not None]
+
     def get_num_records(self):
-        return self._pages[0].get_num_records()
+        return self._get_page(INDIRECTION_COLUMN).get_num_records()
 
     def __getitem__(self, item):
-        return self._pages[item]
+        return self._get_page(item)
 
     def __setitem__(self, key, value):
         self._pages[key] = value
+        self.is_dirty = True
 
     def is_full(self):
-        return not self._pages[0].has_capacity()
+        return not self._get_page(INDIRECTION_COLUMN).has_capacity()
 
     def _get_time_milliseconds(self):
         return int(time() * 1000)
 
     def read_record(self, slot_index: int) -> Sequence[int]:
-        record = []
-        for page in self._pages:
-            record.append(page[slot_index])
-        return record
+        return self.read_fields(slot_index, range(self.num_columns))
 
-    def append_record(self, rid: int, *column_values: int, schema_encoding: int = 0) -> None:
-        expected_column_count = len(self._pages) - METADATA_COLUMN_COUNT
+    # the indirection column is written last, it holds the record count that readers and
+    # commits go by, so a page written while a record is appended never holds half of it
+    def append_record(self, rid: int, *column_values: int, schema_encoding: int = 0, indirection_pointer: int = None, base_rid: int = 0) -> None:
+        expected_column_count = self.num_columns - METADATA_COLUMN_COUNT
         assert len(column_values) == expected_column_count, \
                 "The number of columns do not match.\n" \
                 "Expected " + str(expected_column_count) + \
                 " Received " + str(len(column_values))
-        self._pages[RID_COLUMN].write(rid)
-        self._pages[SCHEMA_ENCODING_COLUMN].write(schema_encoding)
-        self._pages[TIMESTAMP_COLUMN].write(self._get_time_milliseconds())
-        self._pages[BASE_RID_COLUMN].write(0)
-        self._pages[TPS_COLUMN].write(NULL_VALUE)
+        self._get_page(RID_COLUMN).write(rid)
+        self._get_page(SCHEMA_ENCODING_COLUMN).write(schema_encoding)
+        self._get_page(TIMESTAMP_COLUMN).write(self._get_time_milliseconds())
+        self._get_page(BASE_RID_COLUMN).write(base_rid)
+        self._get_page(TPS_COLUMN).write(NULL_VALUE)
+        for i in range(expected_column_count):
+            self._get_page(i + METADATA_COLUMN_COUNT).write(column_values[i])
+        self._get_page(INDIRECTION_COLUMN).write(rid if indirection_pointer is None else indirection_pointer)
+        self.is_dirty = True
+
+    # columns holds one list of values per data column, all of the same length
+    def append_records(self, first_rid: int, columns: Sequence[Sequence[int]], schema_encoding: int = 0) -> None:
+        expected_column_count = self.num_columns - METADATA_COLUMN_COUNT
+        assert len(columns) == expected_column_count, \
+                "The number of columns do not match.\n" \
+                "Expected " + str(expected_column_count) + \
+                " Received " + str(len(columns))
+        count = len(columns[0])
+        rids = range(first_rid, first_rid + count)
+        self._get_page(RID_COLUMN).append_many(rids)
+        self._get_page(SCHEMA_ENCODING_COLUMN).append_many([schema_encoding] * count)
+        self._get_page(TIMESTAMP_COLUMN).append_many([self._get_time_milliseconds()] * count)
+        self._get_page(BASE_RID_COLUMN).append_many([0] * count)
+        self._get_page(TPS_COLUMN).append_many([NULL_VALUE] * count)
         for i in range(expected_column_count):
-            self._pages[i + METADATA_COLUMN_COUNT].write(column_values[i])
-        self._pages[INDIRECTION_COLUMN].write(rid)
+            self._get_page(i + METADATA_COLUMN_COUNT).append_many(columns[i])
+        self._get_page(INDIRECTION_COLUMN).append_many(rids)
         self.is_dirty = True
 
     def edit_record_values(self, slot_index: int, *column_values: int):
-        expected_column_count = len(self._pages) - METADATA_COLUMN_COUNT
+        expected_column_count = self.num_columns - METADATA_COLUMN_COUNT
         assert len(column_values) == expected_column_count, \
                 "The number of columns do not match.\n" \
                 "Expected " + str(expected_column_count) + \
                 " Received " + str(len(column_values))
-        for i in range(len(self._pages)-METADATA_COLUMN_COUNT):
-            self._pages[i + METADATA_COLUMN_COUNT].write_to_pos(column_values[i], slot_index)
+        for i in range(expected_column_count):
+            self._get_page(i + METADATA_COLUMN_COUNT).write_to_pos(column_values[i], slot_index)
+        self.is_dirty = True
 
     def invalidate_record(self, slot_index: int) -> None:
         self.update_indirection_pointer(slot_index, NULL_VALUE)
 
     def update_indirection_pointer(self, slot_index: int, indirection_pointer: int) -> None:
-        indirection_column = self._pages[INDIRECTION_COLUMN]
+        indirection_column = self._get_page(INDIRECTION_COLUMN)
         indirection_column.write_to_pos(indirection_pointer, slot_index)
         self.is_dirty = True
 
     def update_base_rid(self, slot_index: int, base_rid: int) -> None:
-        base_rid_column = self._pages[BASE_RID_COLUMN]
+        base_rid_column = self._get_page(BASE_RID_COLUMN)
         base_rid_column.write_to_pos(base_rid, slot_index)
+        self.is_dirty = True
 
     def update_tps(self, slot_index: int, tps: int) -> None:
-        tps_column = self._pages[TPS_COLUMN]
+        tps_column = self._get_page(TPS_COLUMN)
         tps_column.write_to_pos(tps, slot_index)
+        self.is_dirty = True
 
     def update_schema_encoding(self, slot_index: int, schema_encoding: int) -> None:
-        schema_column = self._pages[SCHEMA_ENCODING_COLUMN]
+        schema_column = self._get_page(SCHEMA_ENCODING_COLUMN)
         schema_column.write_to_pos(schema_encoding, slot_index)
         self.is_dirty = True
 
     def get_page(self, column_index: int) -> Iterator[int]:
-        assert column_index in range(len(self._pages)), \
+        assert column_index in range(self.num_columns), \
                 "column_index out of range: " + str(column_index)
-        return self._pages[column_index]
+        return self._get_page(column_index)
 
     def get_field(self, column_index: int, slot_index: int) -> int:
-        assert column_index in range(len(self._pages)), \
+        assert column_index in range(self.num_columns), \
                 "column_index out of range: " + str(column_index)
-        page = self._pages[column_index]
+        page = self._get_page(column_index)
         return page[slot_index]
 
+    # values of column_indices at slot_index, checking the slot once for all of them
+    def read_fields(self, slot_index: int, column_indices: Sequence[int]) -> List[int]:
+        if self._page_loader is not None:
+            self.load_columns((INDIRECTION_COLUMN, *column_indices))
+        if slot_index < 0 or slot_index >= self._get_page(INDIRECTION_COLUMN).get_num_records():
+            raise Exception("basepage.read_fields: Index " + str(slot_index) + " beyond number of written records in page")
+        # pages not read yet are None, loaded pages are always truthy
+        pages = self._pages
+        return [(pages[column_index] or self._get_page(column_index)).value_at(slot_index) for column_index in column_indices]
+
     def get_indirection_pointer(self, slot_index: int) -> int:
         return self.get_field(INDIRECTION_COLUMN, slot_index)
 
@@ -116,8 +186,8 @@ class BasePage:
     def __str__(self):
         s = ""
         for j in range(0, MAX_RECORDS):
-            for k in range(0, len(self._pages)):
-                if j >= self._pages[k].get_num_records():
+            for k in range(0, self.num_columns):
+                if j >= self[k].get_num_records():
                     s += "0\t"
                 else:
                     if self[k][j] != NULL_VALUE:
@@ -125,27 +195,24 @@ class BasePage:
                     else:
                         s += "N\t"
             s += "\n"
-        s += ("_" * (4 * len(self._pages) - 3) + "\n")
+        s += ("_" * (4 * self.num_columns - 3) + "\n")
         return s
 
     def to_metadata_bytes(self) -> bytes:
         byte_lst = bytearray()
-        for page in self._pages[:METADATA_COLUMN_COUNT]:
-            byte_lst += bytes(page)
+        for i in range(METADATA_COLUMN_COUNT):
+            byte_lst += bytes(self._get_page(i))
         return bytes(byte_lst)
 
     def to_data_bytes(self) -> bytes:
         byte_lst = bytearray()
-        for page in self._pages[METADATA_COLUMN_COUNT:]:
-            byte_lst += bytes(page)
+        for i in range(METADATA_COLUMN_COUNT, self.num_columns):
+            byte_lst += bytes(self._get_page(i))
         return bytes(byte_lst)
 
     @classmethod
     def to_data_bytes_merge(cls, base_page) -> bytes:
-        byte_lst = bytearray()
-        for page in base_page._pages[METADATA_COLUMN_COUNT:]:
-            byte_lst += bytes(page)
-        return bytes(byte_lst)
+        return base_page.to_data_bytes()
 
     @classmethod
     def _convert_bytes_to_page(cls, columns, metadata_bytes, data_bytes):
@@ -163,7 +230,7 @@ class BasePage:
     def _bytes_of_pages(cls, num: int, bytes_pages):
         page_offset = num * PAGE_SIZE
         next_page_offset = (num + 1) * PAGE_SIZE
-        bytes_of_page = bytes_pages[page_offset:next_page_offset]
+        bytes_of_page = memoryview(bytes_pages)[page_offset:next_page_offset]
         return bytes_of_page
 
     @classmethod
@@ -1,9 +1,11 @@
+from functools import partial
 from pathlib import Path
-from threading import Lock
+from threading import Event, Lock, Thread
 from typing import List, Optional, Tuple
 
 from lstore.config import *
 from lstore.basepage import BasePage
+from lstore.page import Page
 
 class PinnableBasePage():
 
@@ -11,6 +13,10 @@ class PinnableBasePage():
         self._base_page = base_page
         self._pin = 0
         self._lock = Lock()
+        # held while the page is written to disk, so two writes of it never overlap
+        self.commit_latch = Lock()
+        # set once the page has been evicted, the evicting thread writes it if it is dirty
+        self.evicted = False
 
     def __enter__(self):
         with self._lock:
@@ -24,6 +30,22 @@ class PinnableBasePage():
     def is_pinned(self):
         return self._pin > 0
 
+    # try_pin and try_evict check each other's flag under the same lock, so a page is
+    # never evicted while pinned and never pinned once it has been evicted
+    def try_pin(self) -> bool:
+        with self._lock:
+            if self.evicted:
+                return False
+            self._pin += 1
+            return True
+
+    def try_evict(self, allow_dirty: bool = True) -> bool:
+        with self._lock:
+            if self._pin > 0 or (not allow_dirty and self._base_page.is_dirty):
+                return False
+            self.evicted = True
+            return True
+
     def is_dirty(self):
         return self._base_page.is_dirty
 
@@ -33,10 +55,52 @@ class PinnableBasePage():
     def __str__(self):
         return str(self._base_page)
 
+# Returned by get_base_page and get_tail_page. Entering it pins the page, looking the page
+# up again if it was evicted after the lookup, so writes never go to an evicted page.
+class PageHandle:
+
+    def __init__(self, bufferpool, index, page_range_data_path, is_base, sequential):
+        self._bufferpool = bufferpool
+        self._index = index
+        self._page_range_data_path = page_range_data_path
+        self._is_base = is_base
+        self._sequential = sequential
+        self._pinned = None
+
+    def __enter__(self):
+        while True:
+            pinnable_base_page = self._bufferpool._get_base_page(self._index, self._page_range_data_path, self._is_base, self._sequential)
+            if pinnable_base_page.try_pin():
+                self._pinned = pinnable_base_page
+                return pinnable_base_page._base_page
+
+    def __exit__(self, type, value, traceback):
+        self._pinned.__exit__(type, value, traceback)
+        self._pinned = None
+
+    def __str__(self):
+        with self as base_page:
+            return str(base_page)
+
 class BufferPool:
 
+    page_store = PAGE_STORE()
+
     def __init__(self):
         self.bufferpool = BUFFERPOOL_EVICTION_STRATEGY(BUFFERPOOL_SIZE)
+        # number of frames written by evicting threads vs by the writeback thread
+        self.foreground_writes = 0
+        self.background_writes = 0
+        self._stats_latch = Lock()
+        self._writeback_latch = Lock()
+        self._writeback_event = Event()
+        self._stop_event = Event()
+        # dirty pages still being written by the thread that evicted them, by frame key, each
+        # with an event set once the page is on disk. Loads of such a page wait for the event.
+        self._evicting = {}
+        self._evicting_latch = Lock()
+        # only runs while a database is open
+        self._writeback_thread = None
 
     @classmethod
     def _create_path(cls,page_range_data_path):
@@ -44,20 +108,10 @@ class BufferPool:
         assert path.exists(), "Does not exist" + str(page_range_data_path)
         return path
 
-    @classmethod
-    def _index_to_filename(cls, index: Tuple[int, int]):
-        return str(index[0]) + "-" + str(index[1]) + ".bin"
-
-    @classmethod
-    def _write_file(cls, path, data: bytes):
-        with path.open('wb') as data_file:
-            data_file.write(data)
-
     @classmethod
     def _write_file_to_dir(cls, page_range_data_path, directory: str, index: Tuple[int, int], data: bytes):
         path = cls._create_path(page_range_data_path)
-        filename = cls._index_to_filename(index)
-        cls._write_file(path / directory / filename, data)
+        cls.page_store.write(path, directory, index, data)
 
     def _write_base_page_metadata(self, index: Tuple[int, int], page_range_data_path, data: bytes):
         adjusted_index = (index[0], 0)
@@ -75,16 +129,10 @@ class BufferPool:
         assert index[1] == 0
         BufferPool._write_file_to_dir(page_range_data_path, TAIL_DATA_DIRECTORY_NAME, index, data)
 
-    @classmethod
-    def _read_file(cls, path) -> bytes:
-        with path.open('rb') as data_file:
-            return data_file.read()
-
     @classmethod
     def _read_file_from_dir(cls, page_range_data_path, directory: str, index: Tuple[int, int]):
         path = cls._create_path(page_range_data_path)
-        filename = cls._index_to_filename(index)
-        return cls._read_file(path / directory / filename)
+        return cls.page_store.read(path, directory, index)
 
     @classmethod
     def _get_base_page_metadata(cls, index: Tuple[int, int], page_range_data_path) -> bytes:
@@ -105,6 +153,7 @@ class BufferPool:
         assert index[1] == 0
         return cls._read_file_from_dir(page_range_data_path, TAIL_DATA_DIRECTORY_NAME, index)
 
+    # loads every column at once
     @classmethod
     def load_base_page(cls, index: Tuple[int,int], page_range_data_path) -> BasePage:
         metadata_bytes = cls._get_base_page_metadata(index, page_range_data_path)
@@ -117,16 +166,139 @@ class BufferPool:
         data_bytes = cls._get_tail_page_data(index, page_range_data_path)
         return BasePage.new_base_page_from_byte(metadata_bytes, data_bytes)
 
-    def _add_frame_to_buffer_pool(self, base_page: PinnableBasePage, index: Tuple[int,int], page_range_data_path, is_base: bool):
-        if self.bufferpool.is_full():
-            frame = self.bufferpool.evict_frame()
-            if frame.base_page.is_dirty():
-                self.commit(frame)
-        return self.bufferpool.add_frame(base_page, index, page_range_data_path, is_base)
+    # returns the column group directory and index holding a column, and the column's offset in it
+    @classmethod
+    def _locate_page(cls, index: Tuple[int,int], is_base: bool, column_index: int):
+        if column_index < METADATA_COLUMN_COUNT:
+            offset = column_index * PAGE_SIZE
+            if is_base:
+                return BASE_META_DIRECTORY_NAME, (index[0], 0), offset
+            return TAIL_META_DIRECTORY_NAME, index, offset
+        offset = (column_index - METADATA_COLUMN_COUNT) * PAGE_SIZE
+        if is_base:
+            return BASE_DATA_DIRECTORY_NAME, index, offset
+        return TAIL_DATA_DIRECTORY_NAME, index, offset
+
+    # the columns of each column group are read with a single read_range spanning all of them
+    @classmethod
+    def _load_pages(cls, index: Tuple[int,int], page_range_data_path, is_base: bool, column_indices: List[int]) -> List[Page]:
+        groups = {}
+        for column_index in column_indices:
+            directory, group_index, offset = cls._locate_page(index, is_base, column_index)
+            groups.setdefault((directory, group_index), []).append((column_index, offset))
+        pages = {}
+        for (directory, group_index), columns in groups.items():
+            start = min(offset for _, offset in columns)
+            end = max(offset for _, offset in columns) + PAGE_SIZE
+            bytes_of_pages = memoryview(cls.page_store.read_range(page_range_data_path, directory, group_index, start, end - start))
+            for column_index, offset in columns:
+                pages[column_index] = Page.new_page_from_bytes(bytes_of_pages[offset - start:offset - start + PAGE_SIZE])
+        return [pages[column_index] for column_index in column_indices]
+
+    # columns of the returned page are only read from disk when a query first touches them
+    @classmethod
+    def load_page_lazily(cls, index: Tuple[int,int], page_range_data_path, is_base: bool) -> BasePage:
+        path = cls._create_path(page_range_data_path)
+        directory, group_index, _ = cls._locate_page(index, is_base, METADATA_COLUMN_COUNT)
+        num_columns = cls.page_store.size(path, directory, group_index) // PAGE_SIZE
+        return BasePage(num_columns, page_loader=partial(cls._load_pages, index, path, is_base))
+
+    def _add_frame_to_buffer_pool(self, base_page: PinnableBasePage, index: Tuple[int,int], page_range_data_path, is_base: bool, sequential: bool = False):
+        # the victim is replaced under the latch so that no other thread takes its slot,
+        # but written outside of it
+        written = None
+        with self._evicting_latch:
+            if self.bufferpool.is_full():
+                frame = self.bufferpool.evict_frame(allow_dirty=False)
+                if frame is None:
+                    # the writeback thread fell behind, let it catch up while we take a dirty victim
+                    self._writeback_event.set()
+                    frame = self.bufferpool.evict_frame()
+                if frame.base_page.is_dirty():
+                    key = self.bufferpool._frame_key(frame.index, frame.page_range_data_path, frame.is_base)
+                    written = self._evicting[key] = Event()
+            new_frame = self.bufferpool.add_frame(base_page, index, page_range_data_path, is_base, sequential)
+        if written is not None:
+            self.commit(frame)
+            self._count_writes(foreground=1)
+            with self._evicting_latch:
+                del self._evicting[key]
+            written.set()
+        return new_frame
+
+    # a page missing from the pool may still be on its way to disk
+    def _wait_for_eviction(self, index: Tuple[int,int], page_range_data_path, is_base: bool):
+        with self._evicting_latch:
+            written = self._evicting.get(self.bufferpool._frame_key(index, page_range_data_path, is_base))
+        if written is not None:
+            written.wait()
+
+    def _count_writes(self, foreground=0, background=0):
+        with self._stats_latch:
+            self.foreground_writes += foreground
+            self.background_writes += background
+
+    def start_writeback(self):
+        if self._writeback_thread is not None:
+            return
+        self._stop_event.clear()
+        self._writeback_thread = Thread(target=self._writeback, daemon=True)
+        self._writeback_thread.start()
+
+    def stop_writeback(self):
+        if self._writeback_thread is None:
+            return
+        self._stop_event.set()
+        self._writeback_event.set()
+        self._writeback_thread.join()
+        self._writeback_thread = None
+
+    def _writeback(self):
+        while not self._stop_event.is_set():
+            self._writeback_event.wait(BUFFERPOOL_WRITEBACK_INTERVAL)
+            self._writeback_event.clear()
+            if self._stop_event.is_set():
+                return
+            self.write_back_dirty_frames()
+
+    # writes dirty frames until BUFFERPOOL_CLEAN_FRAME_FRACTION of the pool can be evicted without a write
+    def write_back_dirty_frames(self):
+        with self._writeback_latch:
+            frames = list(self.bufferpool)
+            dirty_frames = [frame for frame in frames if frame.base_page.is_dirty()]
+            clean_frames = BUFFERPOOL_SIZE - len(dirty_frames)
+            frames_to_clean = int(BUFFERPOOL_SIZE * BUFFERPOOL_CLEAN_FRAME_FRACTION) - clean_frames
+            if frames_to_clean <= 0:
+                return
+            dirty_frames = [frame for frame in dirty_frames if not frame.base_page.is_pinned()]
+            # group the writes of each page range together
+            dirty_frames.sort(key=lambda frame: (str(frame.page_range_data_path), frame.is_base, frame.index))
+            dirty_frames = dirty_frames[:frames_to_clean]
+            for i in range(0, len(dirty_frames), BUFFERPOOL_WRITEBACK_BATCH_SIZE):
+                batch = dirty_frames[i:i + BUFFERPOOL_WRITEBACK_BATCH_SIZE]
+                written = 0
+                for frame in batch:
+                    if self._write_back(frame):
+                        written += 1
+                self._count_writes(background=written)
+            self.page_store.flush()
+
+    # frames evicted since the snapshot was taken are left to the evicting thread
+    def _write_back(self, frame) -> bool:
+        with frame.base_page.commit_latch:
+            if frame.base_page.evicted or not frame.base_page.is_dirty():
+                return False
+            self._commit(frame)
+            return True
 
     def _commit_base_page(self, frame):
         assert frame.is_base
         with frame.base_page as base_page:
+            # cleared before serializing so that concurrent writes mark the page dirty again
+            base_page.is_dirty = False
+            if not base_page.is_fully_resident():
+                self._commit_resident_pages(frame, base_page)
+                return
             metadata_bytes = base_page.to_metadata_bytes()
             data_bytes = base_page.to_data_bytes()
             self._write_base_page_metadata(frame.index, frame.page_range_data_path, metadata_bytes)
@@ -135,12 +307,27 @@ class BufferPool:
     def _commit_tail_page(self, frame):
         assert not frame.is_base
         with frame.base_page as tail_page:
+            tail_page.is_dirty = False
+            if not tail_page.is_fully_resident():
+                self._commit_resident_pages(frame, tail_page)
+                return
             metadata_bytes = tail_page.to_metadata_bytes()
             data_bytes = tail_page.to_data_bytes()
             self._write_tail_page_metadata(frame.index, frame.page_range_data_path, metadata_bytes)
             self._write_tail_page_data(frame.index, frame.page_range_data_path, data_bytes)
 
+    # columns that were never loaded are unchanged on disk, only the resident ones are written
+    def _commit_resident_pages(self, frame, base_page: BasePage):
+        path = self._create_path(frame.page_range_data_path)
+        for column_index, page in base_page.get_resident_pages():
+            directory, group_index, offset = self._locate_page(frame.index, frame.is_base, column_index)
+            self.page_store.write_range(path, directory, group_index, offset, bytes(page))
+
     def commit(self, frame):
+        with frame.base_page.commit_latch:
+            self._commit(frame)
+
+    def _commit(self, frame):
         if frame.is_base:
             self._commit_base_page(frame)
         else:
@@ -148,6 +335,8 @@ class BufferPool:
 
     def _new_base_page(self, index: Tuple[int,int], page_range_data_path, num_columns: int, is_base: bool) -> PinnableBasePage:
         base_page = BasePage(num_columns-METADATA_COLUMN_COUNT)
+        # dirty until its file is first written, in case it is evicted before that
+        base_page.is_dirty = True
         pinnable_base_page = PinnableBasePage(base_page)
         frame = self._add_frame_to_buffer_pool(pinnable_base_page, index, page_range_data_path, is_base)
         self.commit(frame)
@@ -161,37 +350,46 @@ class BufferPool:
         assert index[0] >= 0, "Invalid tail page index: " + str(index)
         return self._new_base_page(index, page_range_data_path, num_columns, is_base=False)
 
-    def _get_from_bufferpool(self, index: Tuple[int,int], page_range_data_path, is_base: bool) -> PinnableBasePage:
-        return self.bufferpool.get_frame(index, page_range_data_path, is_base)
+    def _get_from_bufferpool(self, index: Tuple[int,int], page_range_data_path, is_base: bool, sequential: bool = False) -> PinnableBasePage:
+        return self.bufferpool.get_frame(index, page_range_data_path, is_base, sequential)
 
-    def _get_base_page(self, index: Tuple[int,int], page_range_data_path, is_base: bool) -> PinnableBasePage:
-        pinnable_base_page = self._get_from_bufferpool(index, page_range_data_path, is_base)
+    def _get_base_page(self, index: Tuple[int,int], page_range_data_path, is_base: bool, sequential: bool = False) -> PinnableBasePage:
+        pinnable_base_page = self._get_from_bufferpool(index, page_range_data_path, is_base, sequential)
         if pinnable_base_page is None:
-            if is_base:
-                base_page = self.load_base_page(index, page_range_data_path)
-            else:
-                base_page = self.load_tail_page(index, page_range_data_path)
+            self._wait_for_eviction(index, page_range_data_path, is_base)
+            base_page = self.load_page_lazily(index, page_range_data_path, is_base)
             pinnable_base_page = PinnableBasePage(base_page)
-            self._add_frame_to_buffer_pool(pinnable_base_page, index, page_range_data_path, is_base)
+            frame = self._add_frame_to_buffer_pool(pinnable_base_page, index, page_range_data_path, is_base, sequential)
+            pinnable_base_page = frame.base_page
         return pinnable_base_page
 
-    def get_base_page(self, index: Tuple[int,int], page_range_data_path) -> PinnableBasePage:
+    # sequential tags accesses made by full scans so the eviction policy can keep them from flushing the working set
+    def get_base_page(self, index: Tuple[int,int], page_range_data_path, sequential: bool = False) -> PageHandle:
         assert index[0] in range(RANGE_SIZE), "Invalid base page index" + str(index)
-        return self._get_base_page(index, page_range_data_path, is_base=True)
+        return PageHandle(self, index, page_range_data_path, True, sequential)
 
-    def get_tail_page(self, index: Tuple[int,int], page_range_data_path) -> PinnableBasePage:
+    def get_tail_page(self, index: Tuple[int,int], page_range_data_path, sequential: bool = False) -> PageHandle:
         assert index[0] >=0, "Invalid tail page index" + str(index)
-        return self._get_base_page(index, page_range_data_path, is_base=False)
+        return PageHandle(self, index, page_range_data_path, False, sequential)
 
-    def flush(self):
-        # todo check for pins and dirty
+    # clean frames already match their files on disk and are skipped
+    def _commit_dirty_frames(self, page_range_data_path=None):
         for frame in self.bufferpool:
-            self.commit(frame)
-        self.bufferpool = BUFFERPOOL_EVICTION_STRATEGY(BUFFERPOOL_SIZE)
+            if page_range_data_path is not None and frame.page_range_data_path != page_range_data_path:
+                continue
+            if frame.base_page.is_dirty():
+                self.commit(frame)
 
-    def flush_before_merge(self):
-        frames = list(self.bufferpool._pool.keys())
-        for frame in frames:
-            self.commit(frame)
+    def flush(self):
+        with self._writeback_latch:
+            self._commit_dirty_frames()
+            self.page_store.close()
+            self.bufferpool = BUFFERPOOL_EVICTION_STRATEGY(BUFFERPOOL_SIZE)
+
+    # page_range_data_path limits the flush to the frames of a single page range
+    def flush_before_merge(self, page_range_data_path=None):
+        with self._writeback_latch:
+            self._commit_dirty_frames(page_range_data_path)
+            self.page_store.flush()
 
 bufferpool = BufferPool()
@@ -1,5 +1,6 @@
 
-from lstore.pool import LRUPool
+from lstore.pool import LRUPool, ClockPool, ClockProPool, TwoQueuePool
+from lstore.pagestore import FilePageStore, MmapPageStore, SegmentPageStore
 
 # Global Setting for the Database
 # PageSize, StartRID, etc..
@@ -30,7 +31,38 @@ TPS_COLUMN = 5
 
 METADATA_COLUMN_COUNT = 6
 
-BUFFERPOOL_EVICTION_STRATEGY = LRUPool
+# LRUPool, MRUPool, FIFOPool, LIFOPool, ClockPool, ClockProPool or TwoQueuePool.
+# ClockPool replaced LRUPool as the default: a hit only sets a reference bit, where
+# LRUPool reads the clock and reorders its heap (see benchmarks/pool_lookup.py)
+BUFFERPOOL_EVICTION_STRATEGY = ClockPool
+
+# The writeback thread keeps this fraction of the bufferpool clean so that
+# evictions rarely have to write a dirty page on the caller's thread
+BUFFERPOOL_CLEAN_FRAME_FRACTION = 0.1
+BUFFERPOOL_WRITEBACK_BATCH_SIZE = 64
+# seconds between writeback passes
+BUFFERPOOL_WRITEBACK_INTERVAL = 0.05
+
+# FilePageStore writes one file per page and column group, MmapPageStore keeps one
+# memory-mapped segment file per column group so pages are read without any system calls,
+# SegmentPageStore keeps every page of a page range in one append-only segment file
+# (python -m lstore.pagestore <database path> converts a FilePageStore database)
+PAGE_STORE = FilePageStore
+
+# Index builds pack B+-tree nodes to this fraction of their capacity and sort
+# columns in runs of INDEX_SORT_RUN_SIZE (value, rid) pairs, spilling larger ones to disk
+INDEX_FILL_FACTOR = 0.9
+INDEX_SORT_RUN_SIZE = 1000000
+
+# Table.close writes each index to INDEX_DIRECTORY_NAME/{column}INDEX_FILE_SUFFIX
+INDEX_DIRECTORY_NAME = "Index"
+INDEX_FILE_SUFFIX = ".idx"
+
+# Table.close writes the zone maps of each page range to this file in its directory
+ZONE_MAP_FILE_NAME = "zones.bin"
+
+# Number of records Query.select_cursor reads and yields at a time
+CURSOR_BATCH_SIZE = 1024
 
 BASE_META_DIRECTORY_NAME = "BasePageMetadata"
 BASE_DATA_DIRECTORY_NAME = "BasePageData"
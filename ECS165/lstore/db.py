@@ -12,6 +12,7 @@ class Database():
         self.path = ""
 
     def open(self, path):
+        bufferpool.start_writeback()
         self.path = Path(path)
         if self.path.exists():
             if not self.path.is_dir():
@@ -27,6 +28,7 @@ class Database():
     def close(self):
         for table in self.tables.values():
             table.close()
+        bufferpool.stop_writeback()
         bufferpool.flush()
         for table in self._dropped_tables.values():
             rmtree(table.path)
@@ -1,8 +1,18 @@
-from threading import RLock
+import heapq
+import os
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from functools import partial
+from itertools import groupby
+from tempfile import TemporaryFile
+from threading import Condition, Lock, RLock
+from time import sleep
 
 from lstore.config import *
+from lstore.page import SWAP_BYTES
 from lstore.table import *
-from threading import RLock
 
 
 """
@@ -12,11 +22,23 @@ A data strucutre holding indices for various columns of a table. Key column shou
 
 class Index:
 
+    # columns start out hashed and become B-trees the first time a range is asked for on them
+    default_index_type = None
+
     def __init__(self, table):
         # One index for each table. All our empty initially.
-        self.indices = [None] * table.num_columns
+        self.indices = IndexList([None] * table.num_columns)
+        self.index_types = [self.default_index_type] * table.num_columns
+        # indexes over several columns, by the tuple of their key columns
+        self.composite_indices = {}
         self.table = table
-        pass
+        # writers of a column's index hold its latch shared, replacing the index holds it exclusive
+        self._column_latches = [ColumnLatch() for _ in range(table.num_columns)]
+        # the same for the composite indexes, held exclusive while one is built or dropped
+        self._composite_latch = ColumnLatch()
+        self._load_latch = RLock()
+        # stamp of the table metadata the persisted index files were read against
+        self._stamp = None
 
     """
     # returns the location of all records with the given value on column "column"
@@ -24,14 +46,21 @@ class Index:
 
     def locate(self, column, value):
 
+        if isinstance(column, tuple):
+            if column not in self.composite_indices:
+                self.create_composite_index(column)
+            rids = self.composite_indices[column].locate(value)
+            if rids is None:
+                return False
+            return list(rids)
         if self.indices[column] is None:
             self.create_index(column)
         index = self.indices[column]
-        node_index = index.search_tree(value)
-        if node_index is None:
+        rids = index.search_tree(value)
+        if rids is None:
             return False
         #list of rids
-        return node_index[1].keys[node_index[0]][1]
+        return list(rids)
 
     """
     # Returns the RIDs of all records with values in column "column" between "begin" and "end"
@@ -39,36 +68,104 @@ class Index:
 
     def locate_range(self, begin, end, column):
         if self.indices[column] is None:
-            self.create_index(column)
-        i = begin
+            self.create_index(column, BTree)
+        elif not isinstance(self.indices[column], BTree):
+            self.convert_index(column, BTree)
         lst = []
-        while i <= end:
-            temp = self.locate(column, i)
-            
-            if temp is False:
-                lst = lst 
-            else:
-                lst = lst + temp
-            i = i + 1
+        for value, rids in self.indices[column].range_search(begin, end):
+            lst.extend(rids)
         return lst
 
+    """
+    # Adds many records to the index of a column at once, each distinct value is inserted once
+    """
+
+    def insert_many(self, column, values, rids):
+        rids_by_value = {}
+        for value, rid in zip(values, rids):
+            rids_by_value.setdefault(value, []).append(rid)
+        index = self.indices[column]
+        if index is None:
+            return
+        # large batches merge with the existing entries and rebuild the tree bottom up
+        if isinstance(index, HashIndex) or 4 * len(rids_by_value) < index.size:
+            with self._writing(column) as index:
+                for value in sorted(rids_by_value):
+                    index.insert_to_tree([value, rids_by_value[value]])
+            return
+        # no writer can change the old tree between reading its entries and the swap
+        with self._column_latches[column].exclusive():
+            index = self.indices[column]
+            if index is None:
+                return
+            for entry in index.items():
+                if entry[0] in rids_by_value:
+                    rids_by_value[entry[0]] = list(entry[1]) + rids_by_value[entry[0]]
+                else:
+                    rids_by_value[entry[0]] = entry[1]
+            entries = [[value, rids_by_value[value]] for value in sorted(rids_by_value)]
+            self.indices[column] = BTree.build(entries, INDEX_FILL_FACTOR)
+
+    """
+    # Add, remove and move the rid of a record in the index of a column, if the column is indexed.
+    # Persisted indexes are loaded before the latch is taken, since loading may rebuild them.
+    """
+
+    def insert_rid(self, column, value, rid):
+        with self._writing(column) as index:
+            if index is not None:
+                index.insert_to_tree([value, [rid]])
+
+    def remove_rid(self, column, value, rid):
+        with self._writing(column) as index:
+            if index is not None:
+                index.remove_rid(value, rid)
+
+    def move_rid(self, column, value, rid, new_value):
+        with self._writing(column) as index:
+            if index is not None:
+                index.move_rid(value, rid, new_value)
+
+    @contextmanager
+    def _writing(self, column):
+        self.indices.load(column)
+        with self._column_latches[column].shared():
+            yield self.indices[column]
+
     """
     # optional: Create index on specific column
     """
 
-    def create_index(self, column_number):
-        index = BTree()
-        column_data = self.table.get_column(column_number)
-        rids = self.table.get_metadata_column(RID_COLUMN)
-        rids_list = []
-        for i in rids:
-            i = [i]
-            rids_list.append(i)
-        keys = zip(column_data, rids_list)
-        for key in keys:
-            index.insert_to_tree(list(key))
-        self.indices[column_number] = index
-        # index.print_tree(index.root)
+    def create_index(self, column_number, index_type=None):
+        if index_type is None:
+            index_type = self.index_types[column_number]
+        # writers of records appended after the scan wait for the latch and then add them
+        with self._column_latches[column_number].exclusive():
+            self.index_types[column_number] = index_type
+            pairs = self.table.get_column_with_rids(column_number)
+            if index_type is HashIndex:
+                self.indices[column_number] = HashIndex.from_pairs(pairs)
+                return
+            entries = []
+            for value, group in groupby(sort_pairs(pairs, INDEX_SORT_RUN_SIZE), key=lambda pair: pair[0]):
+                entries.append([value, [rid for _, rid in group]])
+            self.indices[column_number] = index_type.build(entries, INDEX_FILL_FACTOR)
+
+    """
+    # Rebuilds the index of a column as another index type from its current entries
+    """
+
+    def convert_index(self, column_number, index_type):
+        # loading a persisted index may rebuild it under the latch, so it is loaded first
+        self.indices.load(column_number)
+        with self._column_latches[column_number].exclusive():
+            index = self.indices[column_number]
+            # another thread may have converted or dropped it while this one waited
+            if index is None or isinstance(index, index_type):
+                return
+            entries = sorted(index.items())
+            self.indices[column_number] = index_type.build(entries, INDEX_FILL_FACTOR)
+            self.index_types[column_number] = index_type
 
 
     """
@@ -76,27 +173,395 @@ class Index:
     """
 
     def drop_index(self, column_number):
-        self.indices[column_number] = None
+        with self._column_latches[column_number].exclusive():
+            self.indices[column_number] = None
+
+    """
+    # Creates an index keyed by the tuple of values of key_columns. The values of covered_columns are
+    # stored with each rid, so selects that only ask for key and covered columns never read the table
+    """
+
+    def create_composite_index(self, key_columns, covered_columns=()):
+        key_columns = tuple(key_columns)
+        for column in key_columns + tuple(covered_columns):
+            assert column in range(self.table.num_columns), \
+                "column out of range: " + str(column)
+        index = CompositeIndex(key_columns, covered_columns)
+        columns = sorted(set(key_columns + index.covered_columns))
+        row = [None] * self.table.num_columns
+        # writers of records appended after the scan wait for the latch and then add them
+        with self._composite_latch.exclusive():
+            for rid, values in self.table.get_rows_with_rids(columns):
+                for column, value in zip(columns, values):
+                    row[column] = value
+                index.insert(rid, row)
+            self.composite_indices[key_columns] = index
+
+    def drop_composite_index(self, key_columns):
+        with self._composite_latch.exclusive():
+            self.composite_indices.pop(tuple(key_columns), None)
+
+    """
+    # Returns an iterator of (rid, columns) for every record with the given key in column(s), or
+    # None if no composite index on them stores all of query_columns. The rids are located at the
+    # call and each row is read as the iterator reaches it, records deleted meanwhile are skipped.
+    """
+
+    def select_covered(self, column, key, query_columns):
+        if not isinstance(column, tuple):
+            column, key = (column,), (key,)
+        index = self.composite_indices.get(column)
+        if index is None or not index.covers(query_columns):
+            return None
+        rows = ((rid, index.read(rid, key, query_columns)) for rid in index.locate(key) or ())
+        return ((rid, columns) for rid, columns in rows if columns is not None)
+
+    """
+    # Keep the composite indexes in step with inserts, updates and deletes of records. Updates pass
+    # NULL_VALUE for the columns they leave unchanged.
+    """
+
+    def insert_composite(self, rid, columns):
+        with self._composite_latch.shared():
+            for index in list(self.composite_indices.values()):
+                index.insert(rid, columns)
+
+    # rows holds the columns of each rid, the latch is taken once for all of them
+    def insert_composite_many(self, rids, rows):
+        with self._composite_latch.shared():
+            indexes = list(self.composite_indices.values())
+            if not indexes:
+                return
+            records = list(zip(rids, rows))
+            for index in indexes:
+                for rid, columns in records:
+                    index.insert(rid, columns)
+
+    def update_composite(self, rid, old_columns, new_columns):
+        with self._composite_latch.shared():
+            for index in list(self.composite_indices.values()):
+                index.update(rid, old_columns, new_columns)
+
+    def delete_composite(self, rid, columns):
+        with self._composite_latch.shared():
+            for index in list(self.composite_indices.values()):
+                index.delete(rid, columns)
+
+    """
+    # Writes the indexes to the table directory, stamped with the metadata the table was closed with
+    """
+
+    def write_to_dir(self, path, metadata):
+        stamp = zlib.crc32(metadata.encode())
+        index_path = path / INDEX_DIRECTORY_NAME
+        index_path.mkdir(exist_ok=True)
+        for column in range(len(self.indices)):
+            file_path = index_path / (str(column) + INDEX_FILE_SUFFIX)
+            index = list.__getitem__(self.indices, column)
+            if index is None:
+                if file_path.exists():
+                    file_path.unlink()
+            elif isinstance(index, partial):
+                # never loaded so never changed, the file only needs the new stamp
+                _restamp_index_file(file_path, column, self._stamp, stamp)
+            else:
+                _write_index_file(file_path, column, stamp, index)
+        self._stamp = stamp
+
+    """
+    # Registers the persisted indexes of the table, each is read on first use and rebuilt if stale
+    """
+
+    def read_from_dir(self, path, metadata):
+        self._stamp = zlib.crc32(metadata.encode())
+        index_path = path / INDEX_DIRECTORY_NAME
+        for column in range(len(self.indices)):
+            file_path = index_path / (str(column) + INDEX_FILE_SUFFIX)
+            if column == self.table.key or file_path.exists():
+                self.indices[column] = partial(self._load_index, column, file_path)
+
+    def _load_index(self, column, file_path):
+        with self._load_latch:
+            if isinstance(list.__getitem__(self.indices, column), partial):
+                index = None
+                if file_path.exists():
+                    index = _read_index_file(file_path, column, self._stamp)
+                if index is None:
+                    self.create_index(column)
+                else:
+                    self.indices[column] = index
+                    self.index_types[column] = type(index)
+            return list.__getitem__(self.indices, column)
+
+
+# Shared/exclusive latch of the index of one column, or of the composite indexes of a table.
+# Any number of writers share it, since the index types latch their own entries, and
+# replacing or building an index waits for all of them.
+class ColumnLatch:
+
+    def __init__(self):
+        self._condition = Condition()
+        self._writers = 0
+        self._replacing = False
+
+    @contextmanager
+    def shared(self):
+        with self._condition:
+            while self._replacing:
+                self._condition.wait()
+            self._writers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writers -= 1
+                if not self._writers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._condition:
+            while self._replacing or self._writers:
+                self._condition.wait()
+            self._replacing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._replacing = False
+                self._condition.notify_all()
+
+
+# Persisted indexes sit in the list as loaders until they are first accessed
+class IndexList(list):
+
+    def __getitem__(self, column):
+        return self.load(column)
+
+    # reads the persisted index of column if it is still a loader, and returns the index
+    def load(self, column):
+        index = list.__getitem__(self, column)
+        if isinstance(index, partial):
+            index = index()
+        return index
+
+
+# Index files hold a header of magic, column, metadata stamp, index type, key count and
+# rid count, followed by the keys, the end offset of each key's rids and the rids, all as
+# big endian 64 bit values like pages on disk. B-tree keys are written in sorted order.
+INDEX_FILE_MAGIC = int.from_bytes(b"LSTORIDX", "big")
+INDEX_HEADER_LENGTH = 6
+
+def _write_index_file(file_path, column, stamp, tree):
+    keys = array('Q')
+    ends = array('Q')
+    rids = array('Q')
+    for key, key_rids in tree.items():
+        keys.append(key)
+        rids.extend(key_rids)
+        ends.append(len(rids))
+    header = array('Q', [INDEX_FILE_MAGIC, column, stamp, INDEX_FILE_TYPES.index(type(tree)), len(keys), len(rids)])
+    temp_path = file_path.with_suffix(".tmp")
+    with temp_path.open('wb') as index_file:
+        for values in (header, keys, ends, rids):
+            if SWAP_BYTES:
+                values.byteswap()
+            values.tofile(index_file)
+    os.replace(temp_path, file_path)
+
+def _read_header(index_file):
+    header = array('Q')
+    try:
+        header.fromfile(index_file, INDEX_HEADER_LENGTH)
+    except EOFError:
+        return None
+    if SWAP_BYTES:
+        header.byteswap()
+    if header[0] != INDEX_FILE_MAGIC:
+        return None
+    return header
+
+# returns None if the file is damaged or was not written for this column and metadata
+def _read_index_file(file_path, column, stamp):
+    with file_path.open('rb') as index_file:
+        header = _read_header(index_file)
+        if header is None or header[1] != column or header[2] != stamp or header[3] >= len(INDEX_FILE_TYPES):
+            return None
+        index_type = INDEX_FILE_TYPES[header[3]]
+        num_keys, num_rids = header[4], header[5]
+        keys, ends, rids = array('Q'), array('Q'), array('Q')
+        try:
+            keys.fromfile(index_file, num_keys)
+            ends.fromfile(index_file, num_keys)
+            rids.fromfile(index_file, num_rids)
+        except EOFError:
+            return None
+    if SWAP_BYTES:
+        for values in (keys, ends, rids):
+            values.byteswap()
+    entries = []
+    start = 0
+    for key, end in zip(keys, ends):
+        entries.append([key, rids[start:end].tolist()])
+        start = end
+    return index_type.build(entries, INDEX_FILL_FACTOR)
+
+# replaces the stamp of a file that is still valid for old_stamp, stale files are removed
+def _restamp_index_file(file_path, column, old_stamp, new_stamp):
+    if not file_path.exists():
+        return
+    with file_path.open('r+b') as index_file:
+        header = _read_header(index_file)
+        if header is not None and header[1] == column and header[2] == old_stamp:
+            header[2] = new_stamp
+            if SWAP_BYTES:
+                header.byteswap()
+            index_file.seek(0)
+            header.tofile(index_file)
+            return
+    file_path.unlink()
+
+
+# Sorts (value, rid) pairs of 64 bit ints. Runs of run_size pairs are sorted in memory and
+# spilled to temporary files, which are then merged, so large columns never need to be
+# held in memory as Python tuples all at once.
+def sort_pairs(pairs, run_size):
+    run_files = []
+    run = []
+    for pair in pairs:
+        run.append(pair)
+        if len(run) >= run_size:
+            run.sort()
+            run_files.append(_spill_run(run))
+            run = []
+    run.sort()
+    if not run_files:
+        return iter(run)
+    return heapq.merge(*[_read_run(run_file) for run_file in run_files], iter(run))
+
+def _spill_run(run):
+    run_file = TemporaryFile()
+    values = array('Q')
+    for value, rid in run:
+        values.append(value)
+        values.append(rid)
+    values.tofile(run_file)
+    run_file.seek(0)
+    return run_file
+
+def _read_run(run_file, chunk_size=65536):
+    with run_file:
+        while True:
+            values = array('Q')
+            try:
+                values.fromfile(run_file, 2 * chunk_size)
+            except EOFError:
+                pass
+            for i in range(0, len(values), 2):
+                yield values[i], values[i + 1]
+            if len(values) < 2 * chunk_size:
+                return
 
 
 class BTree_Node:
 
-    def __init__(self, leaf=False):
+    def __init__(self, leaf=False, level=0):
         self.keys = []
+        # inner nodes: len(keys) + 1 children, child i holds the keys below keys[i]
         self.children = []
+        # leaves: the rids of each key as a dict used as an ordered set, so a rid is removed in O(1)
+        self.values = []
+        # right sibling on the same level and the smallest key it holds, None on the right edge.
+        # A node only holds keys below high_key, searches for larger keys move right.
+        self.next = None
+        self.high_key = None
         self.leaf = leaf
+        # 0 for leaves, one more for each level above them
+        self.level = level
+        # odd while a writer is changing the node, readers retry if it changed under them
+        self.version = 0
+        # held by the writer changing the node
+        self.latch = Lock()
 
     def length(self):
         return len(self.keys)
 
 
+# B+-tree: every key and its rids live in the leaves, which are linked in key order, so a
+# range query descends once and then walks the leaves. Removing the last rid of a key
+# deletes it from its leaf without rebalancing, leaves may be left underfull or empty.
+#
+# Concurrency follows the B-link tree: every node links to its right sibling and knows
+# the smallest key of it. Readers take no latches, they read each node optimistically
+# and move right when a split moved their key away. Writers latch only the node they
+# change, a split links the new node to its left sibling first and adds it to the parent
+# afterwards, so it is reachable the whole time. Nodes are never merged or removed.
 class BTree:
 
     def __init__(self):
         self.order = 100
         self.root = BTree_Node(True)
-        self._latch = RLock()
-
+        # only taken to grow the tree by a new root
+        self._root_latch = Lock()
+        # number of distinct keys, only used to choose between inserting and rebuilding,
+        # concurrent writers may leave it slightly off
+        self.size = 0
+
+    def _max_keys(self):
+        return (2 * self.order) - 1
+
+    # builds a tree bottom up from [key, rids] entries sorted by distinct keys, nodes are
+    # filled to fill_factor so that later inserts do not split them right away
+    @classmethod
+    def build(cls, entries, fill_factor=1.0):
+        tree = cls()
+        if not entries:
+            return tree
+        max_keys = max(1, int(tree._max_keys() * fill_factor))
+        level = []
+        for i in range(0, len(entries), max_keys):
+            leaf = BTree_Node(True)
+            for key, rids in entries[i:i + max_keys]:
+                leaf.keys.append(key)
+                leaf.values.append(dict.fromkeys(rids))
+            level.append((leaf.keys[0], leaf))
+        cls._link_level(level)
+        # each level pairs every node with the smallest key below it
+        height = 0
+        while len(level) > 1:
+            height = height + 1
+            parents = []
+            for i in range(0, len(level), max_keys + 1):
+                group = level[i:i + max_keys + 1]
+                parent = BTree_Node(level=height)
+                parent.children = [node for _, node in group]
+                parent.keys = [min_key for min_key, _ in group[1:]]
+                parents.append((group[0][0], parent))
+            level = parents
+            cls._link_level(level)
+        tree.root = level[0][1]
+        tree.size = len(entries)
+        return tree
+
+    @classmethod
+    def _link_level(cls, level):
+        for (_, node), (min_key, next_node) in zip(level, level[1:]):
+            node.next = next_node
+            node.high_key = min_key
+
+    # splits only ever move keys to a new right sibling, so the first child is stable
+    def _leftmost_leaf(self):
+        node = self.root
+        while not node.leaf:
+            node = node.children[0]
+        return node
+
+    # yields every (key, rids) pair in key order
+    def items(self):
+        leaf = self._leftmost_leaf()
+        while leaf is not None:
+            keys, values, leaf = self._read(leaf, self._copy_leaf)
+            yield from zip(keys, values)
 
     def print_tree(self, x, l=0):
         print("Level ", l, " ", len(x.keys), end = ":")
@@ -107,266 +572,374 @@ class BTree:
         if len(x.children)>0:
             for i in x.children:
                 self.print_tree(i,l)
-                
-
-    #should return index, node
-    def search_tree(self, key, node=None):
-        with self._latch:
-            if node is not None:
-
-                i = 0
-                while i < node.length() and key > node.keys[i][0]:
-                    i = i + 1
 
-                if i < node.length() and key == node.keys[i][0]:
-                    return(i,node)
-
-                elif node.leaf:
-                    return None
+    # returns read(node) without latching node, retried until no writer changed node meanwhile
+    @staticmethod
+    def _read(node, read):
+        while True:
+            version = node.version
+            if not version & 1:
+                try:
+                    result = read(node)
+                except (IndexError, RuntimeError):
+                    # a writer changed the node halfway through the read
+                    pass
                 else:
-                    return self.search_tree(key, node.children[i])
-
-            else:
-                return self.search_tree(key, self.root)
-
-        
-    def compress_tree(self, key, node=None):
-        with self._latch:
-            if node is not None:
-
-                i = 0
-                while i < node.length() and key[0] > node.keys[i][0]:
-                    i = i + 1
-
-                if i < node.length() and key[0] == node.keys[i][0]:
-                    node.keys[i][1].append(key[1][0])
-                    return True
-
+                    if node.version == version:
+                        return result
+            sleep(0)
+
+    @staticmethod
+    def _copy_leaf(leaf):
+        return list(leaf.keys), [tuple(rids) for rids in leaf.values], leaf.next
+
+    # returns the node on level that holds key and read(node) taken from the same version,
+    # this is _read inlined since every operation descends through it
+    def _find_node(self, key, level=0, read=None):
+        node = self.root
+        while True:
+            version = node.version
+            result = None
+            try:
+                if node.high_key is not None and key >= node.high_key:
+                    next_node = node.next
+                elif node.level == level:
+                    next_node = None
+                    if read is not None:
+                        result = read(node)
+                else:
+                    next_node = node.children[bisect_right(node.keys, key)]
+            except (IndexError, RuntimeError):
+                # a writer changed the node halfway through the read
+                version = -1
+            if version & 1 or node.version != version:
+                sleep(0)
+                continue
+            if next_node is None:
+                return node, result
+            node = next_node
+
+    # latches the node on level that holds key, moving right with latches taken left to right
+    def _lock_node(self, key, level=0):
+        node, _ = self._find_node(key, level)
+        node.latch.acquire()
+        while node.high_key is not None and key >= node.high_key:
+            next_node = node.next
+            next_node.latch.acquire()
+            node.latch.release()
+            node = next_node
+        return node
+
+    @staticmethod
+    def _leaf_rids(leaf, key):
+        i = bisect_left(leaf.keys, key)
+        if i < leaf.length() and leaf.keys[i] == key:
+            return leaf.values[i]
+        return None
+
+    # returns a tuple of the rids of key in insertion order or None. This is _find_node with the
+    # leaf lookup inlined, since a lookup is too short to pay for building and calling a callback.
+    # The rids are copied inside the validated read, callers never see the leaf's own dict.
+    def search_tree(self, key):
+        node = self.root
+        while True:
+            version = node.version
+            try:
+                if node.high_key is not None and key >= node.high_key:
+                    node_next = node.next
                 elif node.leaf:
-                    return False
+                    node_next = None
+                    keys = node.keys
+                    i = bisect_left(keys, key)
+                    rids = tuple(node.values[i]) if i < len(keys) and keys[i] == key else None
                 else:
-                    return self.compress_tree(key, node.children[i])
-
-            else:
-                return self.compress_tree(key, self.root)
-
-
-
+                    node_next = node.children[bisect_right(node.keys, key)]
+            except (IndexError, RuntimeError):
+                # a writer changed the node halfway through the read
+                version = -1
+            if version & 1 or node.version != version:
+                sleep(0)
+                continue
+            if node_next is None:
+                return rids
+            node = node_next
+
+    # yields (key, rids) for every key in [begin, end] in key order
+    def range_search(self, begin, end):
+        leaf, (keys, values, next_leaf) = self._find_node(begin, 0, self._copy_leaf)
+        i = bisect_left(keys, begin)
+        while True:
+            while i < len(keys):
+                if keys[i] > end:
+                    return
+                yield keys[i], values[i]
+                i = i + 1
+            if next_leaf is None:
+                return
+            keys, values, next_leaf = self._read(next_leaf, self._copy_leaf)
+            i = 0
 
+    # key is a [value, rids] entry, rids are added to the value's list if it is already indexed
     def insert_to_tree(self, key):
-        with self._latch:
-            if self.compress_tree(key) is True:
+        self._insert(key[0], key[1])
+
+    def _insert(self, key, rids):
+        leaf = self._lock_node(key)
+        i = bisect_left(leaf.keys, key)
+        if i < leaf.length() and leaf.keys[i] == key:
+            leaf.version += 1
+            leaf.values[i].update(dict.fromkeys(rids))
+            leaf.version += 1
+            leaf.latch.release()
+            return
+        leaf.version += 1
+        leaf.keys.insert(i, key)
+        leaf.values.insert(i, dict.fromkeys(rids))
+        split = None
+        if leaf.length() > self._max_keys():
+            split = self._split_leaf(leaf)
+        leaf.version += 1
+        leaf.latch.release()
+        self.size = self.size + 1
+        if split is not None:
+            self._insert_separator(split[0], split[1], 0)
+
+    # adds a node that split off on level to the level above, splitting upwards as needed
+    def _insert_separator(self, separator, new_node, level):
+        while True:
+            with self._root_latch:
+                if self.root.level == level:
+                    # the old root is the leftmost node of its level, later splits of it
+                    # are added to the new root by their own writers
+                    new_root = BTree_Node(level=level + 1)
+                    new_root.keys = [separator]
+                    new_root.children = [self.root, new_node]
+                    self.root = new_root
+                    return
+            node = self._lock_node(separator, level + 1)
+            i = bisect_right(node.keys, separator)
+            node.version += 1
+            node.keys.insert(i, separator)
+            node.children.insert(i + 1, new_node)
+            split = None
+            if node.length() > self._max_keys():
+                split = self._split_inner(node)
+            node.version += 1
+            node.latch.release()
+            if split is None:
                 return
+            separator, new_node = split
+            level = level + 1
+
+    # both splits fill the new right sibling and link it before shrinking the node
+    def _split_leaf(self, leaf):
+        middle = leaf.length() // 2
+        new_leaf = BTree_Node(True)
+        new_leaf.keys = leaf.keys[middle:]
+        new_leaf.values = leaf.values[middle:]
+        new_leaf.next = leaf.next
+        new_leaf.high_key = leaf.high_key
+        leaf.next = new_leaf
+        leaf.high_key = new_leaf.keys[0]
+        del leaf.keys[middle:]
+        del leaf.values[middle:]
+        return new_leaf.keys[0], new_leaf
+
+    def _split_inner(self, node):
+        middle = node.length() // 2
+        separator = node.keys[middle]
+        new_node = BTree_Node(level=node.level)
+        new_node.keys = node.keys[middle + 1:]
+        new_node.children = node.children[middle + 1:]
+        new_node.next = node.next
+        new_node.high_key = node.high_key
+        node.next = new_node
+        node.high_key = separator
+        del node.keys[middle:]
+        del node.children[middle + 1:]
+        return separator, new_node
+
+    # removes key and all of its rids
+    def delete_in_tree(self, key):
+        leaf = self._lock_node(key)
+        i = bisect_left(leaf.keys, key)
+        if i < leaf.length() and leaf.keys[i] == key:
+            leaf.version += 1
+            del leaf.keys[i]
+            del leaf.values[i]
+            leaf.version += 1
+            self.size = self.size - 1
+        leaf.latch.release()
+
+    # removes a single rid from key, and key itself once it has no rids left
+    def remove_rid(self, key, rid):
+        leaf = self._lock_node(key)
+        i = bisect_left(leaf.keys, key)
+        if i < leaf.length() and leaf.keys[i] == key and rid in leaf.values[i]:
+            leaf.version += 1
+            del leaf.values[i][rid]
+            if not leaf.values[i]:
+                del leaf.keys[i]
+                del leaf.values[i]
+                self.size = self.size - 1
+            leaf.version += 1
+        leaf.latch.release()
+
+    # moves rid from key to new_key
+    def move_rid(self, key, rid, new_key):
+        self.remove_rid(key, rid)
+        self._insert(new_key, (rid,))
+
+
+# Index over a tuple of key columns whose entries also carry the values of covered columns.
+# Merges never change the values of a record, so only inserts, updates and deletes touch it.
+class CompositeIndex:
+
+    def __init__(self, key_columns, covered_columns=()):
+        self.key_columns = tuple(key_columns)
+        self.covered_columns = tuple(column for column in covered_columns if column not in self.key_columns)
+        self.index = HashIndex()
+        # rid -> values of covered_columns
+        self.covered_values = {}
+        self._latch = RLock()
 
-            root = self.root
-
-            if root.length() == (2 * self.order) - 1:
-                test_node = BTree_Node()
-                self.root = test_node
-                test_node.children.insert(0, root)
-                self.split_child(test_node, 0)
-                self.insert_space(test_node, key)
-            else:
-                self.insert_space(root, key)
-
-    def insert_space(self, node, key):
+    def key_of(self, columns):
+        return tuple(columns[column] for column in self.key_columns)
+
+    # true if every queried column is a key or covered column
+    def covers(self, query_columns):
+        for column, query in enumerate(query_columns):
+            if query and column not in self.key_columns and column not in self.covered_columns:
+                return False
+        return True
+
+    # returns the rids of a key tuple or None
+    def locate(self, key):
+        return self.index.search_tree(tuple(key))
+
+    # returns the columns of rid with the ones not in query_columns left as None, or None once
+    # rid is deleted
+    def read(self, rid, key, query_columns):
+        covered_values = self.covered_values.get(rid)
+        if covered_values is None:
+            return None
+        columns = [None] * len(query_columns)
+        for column, value in zip(self.key_columns, key):
+            columns[column] = value
+        for column, value in zip(self.covered_columns, covered_values):
+            columns[column] = value
+        for column, query in enumerate(query_columns):
+            if not query:
+                columns[column] = None
+        return columns
+
+    def insert(self, rid, columns):
         with self._latch:
-            i = node.length() - 1
-
-            if node.leaf:
-                node.keys.append([None, None])
-                while i >= 0 and key[0] < node.keys[i][0]:
-                    node.keys[i + 1] = node.keys[i]
-                    i = i - 1
-                node.keys[i + 1] = key
-            else:
-                while i >= 0 and key[0] < node.keys[i][0]:
-                    i = i - 1
-                i = i + 1
-                if node.children[i].length() == (2 * self.order) - 1:
-                    self.split_child(node, i)
-                    if key[0] > node.keys[i][0]:
-                        i = i + 1
-                self.insert_space(node.children[i], key)
+            self.index.insert_to_tree([self.key_of(columns), [rid]])
+            self.covered_values[rid] = [columns[column] for column in self.covered_columns]
 
-    def split_child(self, node, i):
-        with self._latch:
-            order = self.order
-            next_node = node.children[i]
-            temp = BTree_Node(next_node.leaf)
-            node.children.insert(i + 1, temp)
-            node.keys.insert(i, next_node.keys[order - 1])
-            temp.keys = next_node.keys[order: 2 * order - 1]
-            next_node.keys = next_node.keys[0:order - 1]
-            if not next_node.leaf:
-                temp.children = next_node.children[order:order * 2]
-                next_node.children = next_node.children[0:order - 1]
-
-    def delete_in_tree(self, node, key):
+    def update(self, rid, old_columns, new_columns):
+        columns = [old if new == NULL_VALUE else new for old, new in zip(old_columns, new_columns)]
         with self._latch:
-            order = self.order
-            i = 0
-            while i < node.length() and key[0] > node.keys[i][0]:
-                i = i + 1
-            if node.leaf:
-                if i < node.length() and key[0] == node.keys[i][0]:
-                    node.keys.pop(i)
-                    return
-                return
-            if i < node.length() and key[0] == node.keys[i][0]:
-                return self.delete_inside(node, key, i)
-            elif node.children[i].length() >= order:
-                self.delete_in_tree(node.chilren[i], key)
-            else:
-                if i != 0 and i + 2 < len(node.children):
-                    if node.children[i - 1].length() >= order:
-                        self.delete_sibling(node, i, i - 1)
-                    elif node.chilren[i + 1].length() >= order:
-                        self.delete_sibling(node, i, i + 1)
-                    else:
-                        self.delete_merge(node, i, i + 1)
-
-                elif i == 0:
-                    if node.children[i + 1].length() >= order:
-                        self.delete_sibling(node, i, i + 1)
-                    else:
-                        self.delete_merge(node, i, i + 1)
-                elif i + 1 == len(node.children):
-                    if node.children[i - 1].length() >= order:
-                        self.delete_sibling(node, i, i - 1)
-                    else:
-                        self.delete_merge(node, i, i - 1)
-                self.delete_in_tree(node.children[i], key)
-
-    def delete_inside(self, node, key, i):
+            old_key = self.key_of(old_columns)
+            new_key = self.key_of(columns)
+            if old_key != new_key:
+                self.index.move_rid(old_key, rid, new_key)
+            self.covered_values[rid] = [columns[column] for column in self.covered_columns]
+
+    def delete(self, rid, columns):
         with self._latch:
-            order = self.order
+            self.index.remove_rid(self.key_of(columns), rid)
+            self.covered_values.pop(rid, None)
 
-            if node.leaf:
-                if key[0] == node.keys[i][0]:
-                    node.keys.pop(i)
-                    return
-                return
 
-            if node.children[i].length() >= order:
-                node.keys[i] = self.delete_pred(node.children[i])
-                return
-            elif node.children[i + 1].length() >= order:
-                node.keys[i] = self.delete_suc(node.children[i + 1])
-                return
+# Hash index for columns that are only looked up by equality: a dict from each value to its
+# rids, kept like BTree as a dict used as an ordered set. It offers the same operations as
+# BTree, range_search has to scan every key.
+class HashIndex:
+
+    def __init__(self):
+        self.root = None
+        self._rids = {}
+        self._latch = RLock()
+
+    @property
+    def size(self):
+        return len(self._rids)
+
+    # entries are [key, rids] pairs, fill_factor only matters to BTree
+    @classmethod
+    def build(cls, entries, fill_factor=1.0):
+        index = cls()
+        for key, rids in entries:
+            index._rids[key] = dict.fromkeys(rids)
+        return index
+
+    # builds the index from unsorted (value, rid) pairs
+    @classmethod
+    def from_pairs(cls, pairs):
+        index = cls()
+        for value, rid in pairs:
+            rids = index._rids.get(value)
+            if rids is None:
+                index._rids[value] = {rid: None}
             else:
-                self.delete_merge(node, i, i + 1)
-                self.delete_inside(node.children[i], key, self.order - 1)
+                rids[rid] = None
+        return index
 
-    def delete_pred(self, node):
+    # yields every (key, rids) pair in no particular order
+    def items(self):
         with self._latch:
-            if node.leaf:
-                return node.keys.pop()
-            count = node.length() - 1
-            if node.children[count].length() >= self.order:
-                self.delete_sibling(node, count + 1, count)
-            else:
-                self.delete_merge(node, count, count + 1)
-            self.delete_pred(node.children[count])
+            entries = [(key, tuple(rids)) for key, rids in self._rids.items()]
+        yield from entries
+
+    def print_tree(self, x=None, l=0):
+        for key, rids in self.items():
+            print(key, rids)
 
-    def delete_suc(self, node):
+    # returns a tuple of the rids of key in insertion order or None
+    def search_tree(self, key):
         with self._latch:
-            if node.leaf:
-                return node.keys.pop(0)
-            if node.children[1].length() >= self.order:
-                self.delete_sibling(node, 0, 1)
-            else:
-                self.delete_merge(node, 0, 1)
-            self.delete_suc(node.children[0])
+            rids = self._rids.get(key)
+            return None if rids is None else tuple(rids)
 
-    def delete_merge(self, node, i, j):
+    # yields (key, rids) for every key in [begin, end] in key order
+    def range_search(self, begin, end):
         with self._latch:
-            child = node.children[i]
-            if j > i:
-                right = node.children[j]
-                child.keys.append(node.keys[i])
-
-                for item in range(right.length()):
-                    child.keys.append(right.keys[item])
-                    if len(right.children) > 0:
-                        child.children.append(right.children(item))
-                if len(right.children) > 0:
-                    child.children.append(right.children.pop())
-                new = child
-                node.keys.pop(i)
-                node.children.pop(j)
+            keys = sorted(key for key in self._rids if begin <= key <= end)
+            entries = [(key, tuple(self._rids[key])) for key in keys]
+        yield from entries
 
-            else:
-                left = node.children[j]
-                left.keys.append(node.keys[j])
-                for i in range(child.length()):
-                    left.keys.append(child.keys[i])
-                    if len(left.children) > 0:
-                        left.children.append(child.children[i])
-                if len(left.children) > 0:
-                    left.children.append(child.children.pop())
-                new = left
-                node.keys.pop(j)
-                node.children.pop(i)
-
-            if node == self.root and node.length() == 0:
-                self.root = new
-
-    def delete_sibling(self, node, i, j):
+    # key is a [value, rids] entry, rids are added to the value's list if it is already indexed
+    def insert_to_tree(self, key):
         with self._latch:
-            child = node.child[i]
-            if i < j:
-                right = node.child[j]
-                child.keys.append(node.keys[i])
-                node.keys[i] = right.keys[0]
-                if len(right.children) > 0:
-                    child.children.append(right.children[0])
-                    right.children.pop(0)
-                right.keys.pop(0)
+            rids = self._rids.get(key[0])
+            if rids is None:
+                self._rids[key[0]] = dict.fromkeys(key[1])
             else:
-                left = node.children[j]
-                child.keys.insert(0, node.keys[i - 1])
-                node.keys[i - 1] = left.keys.pop()
-                if len(left.children) > 0:
-                    child.children.insert(0, left.children.pop())
+                rids.update(dict.fromkeys(key[1]))
 
-    def update_tree(self, key, rid, update, node=None):
+    # removes key and all of its rids
+    def delete_in_tree(self, key):
         with self._latch:
-            test = [key, rid]
-
-            if node != None:
-                i = 0
-                while i < node.length() and test != node.keys[i]:
-                    i = i + 1
-                if i < node.length() and test == node.keys[i]:
-                    for j in node.keys[i][1]:
-                        if i == rid:
-                            node.keys[i][1].pop(j)
-                            self.insert_to_tree([update,[rid]])
-                    return
-                elif node.leaf:
-                    return None
-                else:
-                    return self.update_tree(key, rid, update, node.children[i])
-
-            else:
-                return self.update_tree(key, rid, update, self.root)
+            self._rids.pop(key, None)
 
-    def mini_delete(self, key, rid, node=None):
+    # removes a single rid from key, and key itself once it has no rids left
+    def remove_rid(self, key, rid):
         with self._latch:
-            if node != None:
-                i = 0
-                while i < node.length() and key > node.keys[i][0]:
-                    i = i + 1
-                if i < node.length() and key == node.keys[i][0]:
-                    for j in node.keys[i][1]:
-                        if j == rid:
-                            node.keys.pop(j)
-                    return
-                elif node.leaf:
-                    return None
-                else:
-                    return self.mini_delete(key, rid,  node.children[i])
+            rids = self._rids.get(key)
+            if rids is not None and rid in rids:
+                del rids[rid]
+                if not rids:
+                    del self._rids[key]
+
+    # moves rid from key to new_key
+    def move_rid(self, key, rid, new_key):
+        with self._latch:
+            self.remove_rid(key, rid)
+            self.insert_to_tree([new_key, (rid,)])
 
-            else:
-                return self.mini_delete(key, rid, self.root)
+
+Index.default_index_type = HashIndex
+# index types by the code they are stored under in index files
+INDEX_FILE_TYPES = (BTree, HashIndex)
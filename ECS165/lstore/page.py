@@ -1,77 +1,134 @@
+import sys
+from array import array
+from operator import itemgetter
+
 from lstore.config import *
 
+# index and zone map files hold big endian values, which need swapping on this machine if set
+SWAP_BYTES = sys.byteorder != "big"
+
+# The last slot of a page on disk holds num_records as a big endian value whose top byte names
+# the byte order of the values before it. Pages are written in native byte order, so they are
+# read back without a copy. Pages written before the flag existed have 0 there, which stands
+# for big endian, and are byte swapped into a copy when they are read on a little endian machine.
+PAGE_FORMAT_BIG_ENDIAN = 0
+PAGE_FORMAT_LITTLE_ENDIAN = 1
+PAGE_FORMAT_NATIVE = PAGE_FORMAT_LITTLE_ENDIAN if sys.byteorder == "little" else PAGE_FORMAT_BIG_ENDIAN
+PAGE_FORMAT_SHIFT = 56
+
+# pages hold their values in array('Q')s, which have to be TYPE_SIZE bytes wide
+assert array('Q').itemsize == TYPE_SIZE, "array('Q') items are not " + str(TYPE_SIZE) + " bytes"
+
 
 class Page:
 
-    def __init__(self):
-        self.data = bytearray(PAGE_SIZE)
-        # num_records is located in last data slot, bytearray()initializes all bytes to 0
+    # values read from disk are a memoryview of the buffer they were read from, which is only
+    # copied into an array when the page is first written
+    def __init__(self, values=None, num_records=0):
+        if values is None:
+            values = array('Q', bytes(MAX_RECORDS * TYPE_SIZE))
+        self._values = values
+        self.num_records = num_records
 
-    def set_data(self, data):
-        self.data = data
-        
-    # read last data slot in page to get num_records
     def get_num_records(self):
-        return int.from_bytes(self.data[PAGE_SIZE-TYPE_SIZE:], "big")
-      
+        return self.num_records
+
     def _inc_num_records(self):
-        num_records = self.get_num_records()
-        num_records += 1
-        self.data[PAGE_SIZE-TYPE_SIZE:] = num_records.to_bytes(TYPE_SIZE, "big")
-        
+        self.num_records += 1
+
     def __getitem__(self, key):
         return self.read_int(key)
 
     # one less slot available due to num_records
     def has_capacity(self):
-        return (self.get_num_records() + 1) * TYPE_SIZE < PAGE_SIZE
+        return self.num_records < MAX_RECORDS
+
+    def _writable_values(self):
+        values = self._values
+        if type(values) is not array:
+            values = array('Q')
+            values.frombytes(self._values.cast('B'))
+            self._values = values
+        return values
 
     def write(self, value):
-        # This accounts for offsets by starting at 8 * num_records and ending at 8 * (num_records + 1)
-        # It also updates num_records
-        # TYPE_SIZE is a constant which is equal to 8, it is the size of the datatype
-        # The bytes are stored in big endian form
         if not self.has_capacity():
             raise Exception("page.write: No space left in this page")
-
-        self.data[self.get_num_records() * TYPE_SIZE: (self.get_num_records() + 1) * TYPE_SIZE] = value.to_bytes(TYPE_SIZE, "big")
-        self._inc_num_records()
+        self._writable_values()[self.num_records] = value
+        self.num_records += 1
 
     def write_to_pos(self, value, position):
-        if self.get_num_records() == 0:
+        if self.num_records == 0:
             raise Exception("page.write_to_pos: No data to read in this page")
         if position >= MAX_RECORDS or position < 0:
             raise Exception("page.write_to_pos: Index out of range")
 
-        if position > self.get_num_records() - 1:
+        if position > self.num_records - 1:
             raise Exception("page.write_to_pos: Index " + str(position) + " beyond number of written records in page")
-        self.data[position * TYPE_SIZE: (position + 1) * TYPE_SIZE] = value.to_bytes(TYPE_SIZE, "big")
+        self._writable_values()[position] = value
 
-    # returns TYPE_SIZE bytes at a given record index in the page
-    def _read_bytes(self, index):
-        if self.get_num_records() == 0:
-            raise Exception("page._read_bytes: No data to read in this page")
+    # returns an int at a given record index in the page
+    def read_int(self, index):
+        if self.num_records == 0:
+            raise Exception("page.read_int: No data to read in this page")
         if index >= MAX_RECORDS or index < 0:
-            raise Exception("page._read_bytes: Index out of range")
+            raise Exception("page.read_int: Index out of range")
 
-        if index > self.get_num_records() - 1:
-            raise Exception("page._read_bytes: Index " + str(index) + " beyond number of written records in page")
-        return self.data[index * TYPE_SIZE: index * TYPE_SIZE + TYPE_SIZE]
+        if index > self.num_records - 1:
+            raise Exception("page.read_int: Index " + str(index) + " beyond number of written records in page")
+        return self._values[index]
 
-    # returns an int at a given record index in the page
-    def read_int(self, index):
-        return int.from_bytes(self._read_bytes(index), "big")
+    # returns the int at a given record index without the checks of read_int, for callers
+    # that already checked the index against the number of records
+    def value_at(self, index):
+        return self._values[index]
+
+    # returns the ints at the given record indices in the page
+    def read_many(self, slots):
+        slots = list(slots)
+        if not slots:
+            return []
+        if min(slots) < 0 or max(slots) >= self.num_records:
+            raise Exception("page.read_many: Index beyond number of written records in page")
+        if len(slots) == 1:
+            return [self._values[slots[0]]]
+        return list(itemgetter(*slots)(self._values))
+
+    # returns a copy of all written values
+    def as_array(self):
+        values = self._values[:self.num_records]
+        if type(values) is array:
+            return values
+        copy = array('Q')
+        copy.frombytes(values.cast('B'))
+        return copy
+
+    def append_many(self, values):
+        values = array('Q', values)
+        if self.num_records + len(values) > MAX_RECORDS:
+            raise Exception("page.append_many: No space left in this page")
+        self._writable_values()[self.num_records:self.num_records + len(values)] = values
+        self.num_records += len(values)
 
     def __iter__(self):
-        for i in range(self.get_num_records()):
-            yield self.read_int(i)
+        return iter(self._values[:self.num_records])
 
     def __bytes__(self):
-        return bytes(self.data)
+        trailer = PAGE_FORMAT_NATIVE << PAGE_FORMAT_SHIFT | self.num_records
+        return self._values.tobytes() + trailer.to_bytes(TYPE_SIZE, "big")
 
+    # bytes_of_pages may be any buffer, pages in native byte order keep referring to it
     @classmethod
     def new_page_from_bytes(cls, bytes_of_pages):
         assert len(bytes_of_pages) == PAGE_SIZE, "Unequal page size" + str(len(bytes_of_pages))
-        page = Page()
-        page.set_data(bytearray(bytes_of_pages))
-        return page
+        bytes_of_pages = memoryview(bytes_of_pages)
+        trailer = int.from_bytes(bytes_of_pages[MAX_RECORDS * TYPE_SIZE:], "big")
+        byte_order = trailer >> PAGE_FORMAT_SHIFT
+        num_records = trailer & ((1 << PAGE_FORMAT_SHIFT) - 1)
+        if byte_order == PAGE_FORMAT_NATIVE:
+            values = bytes_of_pages[:MAX_RECORDS * TYPE_SIZE].cast('Q')
+        else:
+            values = array('Q')
+            values.frombytes(bytes_of_pages[:MAX_RECORDS * TYPE_SIZE])
+            values.byteswap()
+        return cls(values, num_records)
@@ -1,12 +1,13 @@
 from pathlib import Path
 from time import time
 from threading import Lock
-from typing import Tuple, Iterator, Sequence
+from typing import Tuple, Iterator, Sequence, List
 
 from lstore.basepage import BasePage, Page
 from lstore.config import *
 from lstore.bufferpool import bufferpool
 from lstore.bufferpool import BufferPool
+from lstore.zonemap import ZoneMap, read_zone_maps, write_zone_maps
 
 
 # Unlimited tail rows, RANGE_SIZE base rows
@@ -18,6 +19,11 @@ class PageRange:
         self._page_range_data_path = Path(page_range_data_path)
         self._base_pages_counter = num_base_pages
         self._version_nums = version_nums
+        # one zone map per base page, None where it is not known
+        self._zone_maps = read_zone_maps(self._page_range_data_path / ZONE_MAP_FILE_NAME, self.get_metadata_for(num_base_pages, num_tail_records),
+                                         num_columns, num_base_pages) or [None] * num_base_pages
+        # zone maps widened by updates while a merge runs, by base page index
+        self._merge_widened = None
         if self._base_pages_counter == 0:
             self._tail_pages_counter = 0
             self._add_base_page()
@@ -27,19 +33,27 @@ class PageRange:
         self._latch = Lock()
 
     def get_metadata(self):
-        return [self._base_pages_counter, self._next_tail_page_rid - (self._base_rid + RECORDS_PER_PAGE_RANGE)]
+        return self.get_metadata_for(self._base_pages_counter, self._next_tail_page_rid - (self._base_rid + RECORDS_PER_PAGE_RANGE))
+
+    @classmethod
+    def get_metadata_for(cls, num_base_pages, num_tail_records):
+        return [num_base_pages, num_tail_records]
+
+    # written next to the page range metadata by Table.close
+    def write_zone_maps(self):
+        write_zone_maps(self._page_range_data_path / ZONE_MAP_FILE_NAME, self.get_metadata(), self.num_columns, self._zone_maps)
 
     def get_path(self):
         return self._page_range_data_path
 
-    def _get_base(self, index: int) -> BasePage:
+    def _get_base(self, index: int, sequential: bool = False) -> BasePage:
         base_index = (index, self._version_nums[index])
-        base_page = bufferpool.get_base_page(base_index, self._page_range_data_path)
+        base_page = bufferpool.get_base_page(base_index, self._page_range_data_path, sequential)
         return base_page
 
-    def _get_tail(self, index: int) -> BasePage:
+    def _get_tail(self, index: int, sequential: bool = False) -> BasePage:
         tail_index = (index, 0)
-        tail_page = bufferpool.get_tail_page(tail_index, self._page_range_data_path)
+        tail_page = bufferpool.get_tail_page(tail_index, self._page_range_data_path, sequential)
         return tail_page
 
     def is_full(self):
@@ -60,6 +74,7 @@ class PageRange:
         version_num = 0
         index = (self._base_pages_counter, version_num)
         bufferpool.new_base_page(index, self._page_range_data_path, self.num_columns + METADATA_COLUMN_COUNT)
+        self._zone_maps.append(ZoneMap(self.num_columns))
         self._base_pages_counter += 1
 
     def _add_tail_page(self):
@@ -94,6 +109,32 @@ class PageRange:
                 self._add_base_page()
         with self._get_current_base_page() as base_page:
             base_page.append_record(rid, *column_values)
+        zone_map = self._zone_maps[self._base_pages_counter - 1]
+        if zone_map is not None:
+            with self._latch:
+                zone_map.append(column_values)
+
+    # appends as many of the given records as fit in this page range, a base page at a time,
+    # and returns how many were appended
+    def append_records(self, first_rid: int, columns: Sequence[Sequence[int]]) -> int:
+        total = len(columns[0])
+        appended = 0
+        while appended < total:
+            with self._get_current_base_page() as base_page:
+                if base_page.is_full():
+                    if self._base_pages_counter == RANGE_SIZE:
+                        break
+                    self._add_base_page()
+                    continue
+                count = min(total - appended, MAX_RECORDS - base_page.get_num_records())
+                batch = [column[appended:appended + count] for column in columns]
+                base_page.append_records(first_rid + appended, batch)
+                zone_map = self._zone_maps[self._base_pages_counter - 1]
+                if zone_map is not None:
+                    with self._latch:
+                        zone_map.append_many(batch)
+                appended += count
+        return appended
 
     def _determine_schema_encoding(self, column_values: [int]) -> int:
         schema = 0
@@ -104,13 +145,14 @@ class PageRange:
 
     def update_record(self, rid: int, *column_values: int) -> None:
         def create_snapshot_record():
-            current_columns = self.read_record(rid)[METADATA_COLUMN_COUNT:]
+            # the record has never been updated, so its base values are current
+            current_columns = base_page.read_record(base_page_slot_index)[METADATA_COLUMN_COUNT:]
             update_rid, tail_full = self._append_record_to_tail_page(rid, *current_columns, schema_encoding=0, base_rid=NULL_VALUE)
             base_page.update_indirection_pointer(base_page_slot_index, update_rid)
             return update_rid, tail_full
         def calculate_new_schema_encoding():
             schema_encoding = self._determine_schema_encoding(column_values)
-            schema_encoding |= self.get_field(SCHEMA_ENCODING_COLUMN, rid)
+            schema_encoding |= base_page.get_schema_encoding(base_page_slot_index)
             return schema_encoding
         def determine_cumulative_columns(last_update_rid: int):
             tail_page_index, tail_page_slot_index = self._get_tail_page_indices(last_update_rid)
@@ -120,11 +162,11 @@ class PageRange:
                     if value != NULL_VALUE:
                         result[i] = value
             return result
-        self._assert_not_deleted(rid)
         base_page_index, base_page_slot_index = self._get_base_page_indices(rid)
         with self._get_base(base_page_index) as base_page:
             assert base_page.get_rid(base_page_slot_index) == rid, "RIDs don't match"
             last_update_rid = base_page.get_indirection_pointer(base_page_slot_index)
+            self._assert_not_deleted(rid, last_update_rid)
             tail_full1 = False
             if last_update_rid == rid:
                 last_update_rid, tail_full1 = create_snapshot_record()
@@ -134,6 +176,7 @@ class PageRange:
             tail_rid, tail_full2 = self._append_record_to_tail_page(last_update_rid, *columns, schema_encoding=schema_encoding, base_rid=rid)
             base_page.update_indirection_pointer(base_page_slot_index, tail_rid)
             base_page.update_schema_encoding(base_page_slot_index, schema_encoding)
+            self._widen_zone_map(base_page_index, column_values)
             if tail_full1 != False:
                 return tail_full1
             return tail_full2
@@ -142,10 +185,8 @@ class PageRange:
         with self._latch:
             with self._get_current_tail_page() as current_tail_page:
                 assert not current_tail_page.is_full()
-                current_tail_page.append_record(self._next_tail_page_rid, *column_values, schema_encoding=schema_encoding)
-                _, slot_index = self._get_tail_page_indices(self._next_tail_page_rid)
-                current_tail_page.update_indirection_pointer(slot_index, indirection_pointer)
-                current_tail_page.update_base_rid(slot_index, base_rid)
+                current_tail_page.append_record(self._next_tail_page_rid, *column_values, schema_encoding=schema_encoding,
+                                                indirection_pointer=indirection_pointer, base_rid=base_rid)
                 self._next_tail_page_rid += 1
                 tail_full = False
                 if current_tail_page.is_full():
@@ -153,24 +194,36 @@ class PageRange:
                     tail_full = True
                 return self._next_tail_page_rid - 1, tail_full
 
-    def _assert_not_deleted(self, rid):
-        if self._is_record_deleted(rid):
+    def _widen_zone_map(self, base_page_index: int, column_values: Sequence[int]) -> None:
+        with self._latch:
+            zone_map = self._zone_maps[base_page_index]
+            if zone_map is not None:
+                zone_map.widen(column_values)
+            if self._merge_widened is not None:
+                self._merge_widened.setdefault(base_page_index, ZoneMap(self.num_columns)).widen(column_values)
+
+    # indirection_pointer is the base record's, when the caller has already read it
+    def _assert_not_deleted(self, rid, indirection_pointer=None):
+        if indirection_pointer is None:
+            deleted = self._is_record_deleted(rid)
+        else:
+            deleted = indirection_pointer == NULL_VALUE
+        if deleted:
             raise InvalidRIDException("Record with rid " + str(rid) + " is deleted")
 
     def read_base_record(self, rid: int) -> Sequence[int]:
-        self._assert_not_deleted(rid)
-        self._assert_not_deleted(rid)
         base_page_index, base_page_slot_index = self._get_base_page_indices(rid)
         with self._get_base(base_page_index) as base_page:
+            self._assert_not_deleted(rid, base_page.get_indirection_pointer(base_page_slot_index))
             base_record = base_page.read_record(base_page_slot_index)
             return base_record 
 
     def undo_update(self, rid: int):
-        self._assert_not_deleted(rid)
         base_page_index, base_page_slot_index = self._get_base_page_indices(rid)
         with self._get_base(base_page_index) as base_page:
             assert base_page.get_rid(base_page_slot_index) == rid, "RIDs don't match"
             last_update_rid = base_page.get_indirection_pointer(base_page_slot_index)
+            self._assert_not_deleted(rid, last_update_rid)
             tail_page_index, tail_page_slot_index = self._get_tail_page_indices(last_update_rid)
             with self._get_tail(tail_page_index) as tail_page:
                 last_version = tail_page.get_indirection_pointer(tail_page_slot_index)
@@ -179,49 +232,82 @@ class PageRange:
                 base_page.update_schema_encoding(base_page_slot_index, last_schema)
 
     def read_record(self, rid: int) -> Sequence[int]:
-        def build_updated_record():
-            updated_record = self._read_updated_record(last_update_rid)
-            # keep the metadata columns from the base record
-            # we want the rid to be the base rid
-            result = base_record[:METADATA_COLUMN_COUNT]
-            for i in range(METADATA_COLUMN_COUNT, len(base_record)):
-                if updated_record[i] == NULL_VALUE:
-                    result.append(base_record[i])
-                else:
-                    result.append(updated_record[i])
-            return result
-
-        self._assert_not_deleted(rid)
+        return self.read_columns(rid)
+
+    # returns the current values of column_indices of rid, all columns if None. The base page is
+    # pinned once for the deleted check, the indirection and the base values, and the tail page
+    # at most once, only if the schema encoding shows a requested column was updated. Metadata
+    # columns always come from the base record, so the rid is the base rid. Only the pages of
+    # the requested columns are read.
+    def read_columns(self, rid: int, column_indices: Sequence[int] = None) -> List[int]:
         base_page_index, base_page_slot_index = self._get_base_page_indices(rid)
         with self._get_base(base_page_index) as base_page:
-            last_update_rid = base_page.get_indirection_pointer(base_page_slot_index)
-            tps = base_page.get_tps(base_page_slot_index)
-            base_record = base_page.read_record(base_page_slot_index)
+            last_update_rid, tps, schema_encoding = base_page.read_fields(base_page_slot_index, (INDIRECTION_COLUMN, TPS_COLUMN, SCHEMA_ENCODING_COLUMN))
+            self._assert_not_deleted(rid, last_update_rid)
+            if column_indices is None:
+                column_indices = range(base_page.num_columns)
+            values = base_page.read_fields(base_page_slot_index, column_indices)
             if last_update_rid == rid or (tps >= last_update_rid and tps != NULL_VALUE):
-                return base_record
-        return build_updated_record()
-
+                return values
+        # _is_field_updated inlined, the check runs once per requested column
+        shift = 63 + METADATA_COLUMN_COUNT
+        updated = [(i, column_index) for i, column_index in enumerate(column_indices) if column_index >= METADATA_COLUMN_COUNT and
+                   schema_encoding >> (shift - column_index) & 1]
+        if not updated:
+            return values
+        tail_page_index, tail_page_slot_index = self._get_tail_page_indices(last_update_rid)
+        with self._get_tail(tail_page_index) as tail_page:
+            tail_values = tail_page.read_fields(tail_page_slot_index, [column_index for _, column_index in updated])
+        for (i, _), value in zip(updated, tail_values):
+            if value != NULL_VALUE:
+                values[i] = value
+        return values
+
+    # read_columns for many rids at once, pinning each base and tail page they touch once.
+    # Returns the values of each rid in order, None for deleted records.
+    def read_columns_many(self, rids: Sequence[int], column_indices: Sequence[int]) -> List[List[int]]:
+        results = [None] * len(rids)
+        by_base_page = {}
+        for i, rid in enumerate(rids):
+            base_page_index, base_page_slot_index = self._get_base_page_indices(rid)
+            by_base_page.setdefault(base_page_index, []).append((i, rid, base_page_slot_index))
+        data_columns = [(j, column_index) for j, column_index in enumerate(column_indices) if column_index >= METADATA_COLUMN_COUNT]
+        tail_reads = {}
+        for base_page_index, records in by_base_page.items():
+            with self._get_base(base_page_index) as base_page:
+                for i, rid, base_page_slot_index in records:
+                    last_update_rid, tps, schema_encoding = base_page.read_fields(base_page_slot_index, (INDIRECTION_COLUMN, TPS_COLUMN, SCHEMA_ENCODING_COLUMN))
+                    if last_update_rid == NULL_VALUE:
+                        continue
+                    results[i] = base_page.read_fields(base_page_slot_index, column_indices)
+                    if last_update_rid == rid or (tps >= last_update_rid and tps != NULL_VALUE):
+                        continue
+                    updated = [(j, column_index) for j, column_index in data_columns
+                               if self._is_field_updated(schema_encoding, column_index - METADATA_COLUMN_COUNT)]
+                    if updated:
+                        tail_page_index, tail_page_slot_index = self._get_tail_page_indices(last_update_rid)
+                        tail_reads.setdefault(tail_page_index, []).append((i, tail_page_slot_index, updated))
+        for tail_page_index, reads in tail_reads.items():
+            with self._get_tail(tail_page_index) as tail_page:
+                for i, tail_page_slot_index, updated in reads:
+                    tail_values = tail_page.read_fields(tail_page_slot_index, [column_index for _, column_index in updated])
+                    for (j, _), value in zip(updated, tail_values):
+                        if value != NULL_VALUE:
+                            results[i][j] = value
+        return results
+
+    # only the base record is invalidated, its tail records are unreachable from then on
+    # and are skipped by the next merge, so the cost does not grow with the update history
     def delete_record(self, rid: int) -> None:
-        self._assert_not_deleted(rid)
         base_page_index, base_page_slot_index = self._get_base_page_indices(rid)
         with self._get_base(base_page_index) as base_page:
             last_update_rid = base_page.get_indirection_pointer(base_page_slot_index)
-            self._invalidate_tail_record(last_update_rid, rid)
+            self._assert_not_deleted(rid, last_update_rid)
             base_page.invalidate_record(base_page_slot_index)
-
-    def _invalidate_tail_record(self, rid: int, base_rid: int) -> None:
-        if rid == base_rid:
-            return
-        tail_page_index, tail_page_slot_index = self._get_tail_page_indices(rid)
-        with self._get_tail(tail_page_index) as tail_page:
-            previous_record_rid = tail_page.get_indirection_pointer(tail_page_slot_index)
-            tail_page.invalidate_record(tail_page_slot_index)
-        self._invalidate_tail_record(previous_record_rid, base_rid)
-
-    def _read_updated_record(self, rid: int) -> Sequence[int]:
-        tail_page_index, tail_page_slot_index = self._get_tail_page_indices(rid)
-        with self._get_tail(tail_page_index) as tail_page:
-            return tail_page.read_record(tail_page_slot_index)
+        with self._latch:
+            zone_map = self._zone_maps[base_page_index]
+            if zone_map is not None:
+                zone_map.num_deleted += 1
 
     def _is_record_deleted(self, rid: int) -> bool:
         base_page_index, base_page_slot_index = self._get_base_page_indices(rid)
@@ -235,30 +321,110 @@ class PageRange:
         return ((schema_encoding >> bit_index) & 1) == 1
 
     def get_field(self, column_index: int, rid: int) -> int:
-        def get_field_from_tail_record():
+        assert column_index in range(self.num_columns + METADATA_COLUMN_COUNT), \
+                "column_index out of range: " + str(column_index)
+        return self.read_columns(rid, (column_index,))[0]
+
+    # base_page must already be pinned by the caller
+    def _get_field_of_base_page(self, base_page: BasePage, base_page_slot_index: int, column_index: int, rid: int, sequential: bool = False) -> int:
+        last_update_rid = base_page.get_indirection_pointer(base_page_slot_index)
+        if last_update_rid == rid or column_index < METADATA_COLUMN_COUNT:
+            # return meta fields from the base record to be consistent with read record
+            return base_page.get_field(column_index, base_page_slot_index)
+
+        schema_encoding = base_page.get_field(SCHEMA_ENCODING_COLUMN, base_page_slot_index)
+        if self._is_field_updated(schema_encoding, column_index - METADATA_COLUMN_COUNT):
             tail_page_index, tail_page_slot_index = self._get_tail_page_indices(last_update_rid)
-            with self._get_tail(tail_page_index) as tail_page:
+            with self._get_tail(tail_page_index, sequential) as tail_page:
                 return tail_page.get_field(column_index, tail_page_slot_index)
-
-        self._assert_not_deleted(rid)
-        base_page_index, base_page_slot_index = self._get_base_page_indices(rid)
-        with self._get_base(base_page_index) as base_page:
-            last_update_rid = base_page.get_indirection_pointer(base_page_slot_index)
-            if last_update_rid == rid or column_index < METADATA_COLUMN_COUNT:
-                # return meta fields from the base record to be consistent with read record
-                return base_page.get_field(column_index, base_page_slot_index)
-
-            schema_encoding = base_page.get_field(SCHEMA_ENCODING_COLUMN, base_page_slot_index)
-            if self._is_field_updated(schema_encoding, column_index - METADATA_COLUMN_COUNT):
-                return get_field_from_tail_record()
-            return base_page.get_field(column_index, base_page_slot_index)
+        return base_page.get_field(column_index, base_page_slot_index)
 
     def get_column(self, column_index: int) -> Iterator[int]:
+        for value, _ in self.get_column_with_rids(column_index):
+            yield value
+
+    # full scan: pages are requested as sequential and each base page is pinned once. Records
+    # are appended with their indirection written last, so scans stop at the records that have one.
+    def get_column_with_rids(self, column_index: int) -> Iterator[Tuple[int, int]]:
+        for i in range(self._base_pages_counter):
+            with self._get_base(i, sequential=True) as base_page_row:
+                for slot_index, rid in zip(range(base_page_row.get_num_records()), base_page_row.get_page(RID_COLUMN)):
+                    if base_page_row.get_indirection_pointer(slot_index) != NULL_VALUE:
+                        yield self._get_field_of_base_page(base_page_row, slot_index, column_index, rid, sequential=True), rid
+
+    # yields (value, rid) of every record whose value in column_index lies in [low, high],
+    # base pages whose zone map rules the range out are skipped without being loaded
+    def scan_range(self, column_index: int, low: int, high: int) -> Iterator[Tuple[int, int]]:
+        assert column_index in range(METADATA_COLUMN_COUNT, METADATA_COLUMN_COUNT + self.num_columns), \
+            "zone maps only cover data columns: " + str(column_index)
         for i in range(self._base_pages_counter):
-            with self._get_base(i) as base_page_row:
-                for rid in base_page_row.get_page(RID_COLUMN):
-                    if not self._is_record_deleted(rid):
-                        yield self.get_field(column_index, rid)
+            zone_map = self._zone_maps[i]
+            if zone_map is not None and not zone_map.might_contain(column_index - METADATA_COLUMN_COUNT, low, high):
+                continue
+            with self._get_base(i, sequential=True) as base_page_row:
+                for slot_index, rid in zip(range(base_page_row.get_num_records()), base_page_row.get_page(RID_COLUMN)):
+                    if base_page_row.get_indirection_pointer(slot_index) != NULL_VALUE:
+                        value = self._get_field_of_base_page(base_page_row, slot_index, column_index, rid, sequential=True)
+                        if low <= value <= high:
+                            yield value, rid
+
+    # yields, for each base page with a live record whose predicate_column value lies in
+    # [low, high], one list per column_indices with the current values of those records.
+    # Each base page is pinned once and each tail page holding updates of it read once.
+    def scan_columns(self, column_indices: Sequence[int], predicate_column: int, low: int, high: int) -> Iterator[List[List[int]]]:
+        for i in range(self._base_pages_counter):
+            zone_map = self._zone_maps[i]
+            if zone_map is not None and predicate_column >= METADATA_COLUMN_COUNT and \
+                    not zone_map.might_contain(predicate_column - METADATA_COLUMN_COUNT, low, high):
+                continue
+            with self._get_base(i, sequential=True) as base_page:
+                columns = self._read_page_columns(base_page, [predicate_column] + list(column_indices))
+            predicate_values = columns[0]
+            matches = [j for j, value in enumerate(predicate_values) if low <= value <= high]
+            if not matches:
+                continue
+            if len(matches) == len(predicate_values):
+                yield columns[1:]
+            else:
+                yield [[column[j] for j in matches] for column in columns[1:]]
+
+    # current values of column_indices for every live record of a pinned base page
+    def _read_page_columns(self, base_page: BasePage, column_indices: Sequence[int]) -> List[List[int]]:
+        base_page.load_columns([RID_COLUMN, INDIRECTION_COLUMN, TPS_COLUMN, SCHEMA_ENCODING_COLUMN] + list(column_indices))
+        rids = base_page.get_page(RID_COLUMN).as_array()
+        indirections = base_page.get_page(INDIRECTION_COLUMN).as_array()
+        live_slots = [slot for slot, indirection in enumerate(indirections) if indirection != NULL_VALUE]
+        all_live = len(live_slots) == len(indirections)
+        columns = []
+        for column_index in column_indices:
+            values = base_page.get_page(column_index).as_array()
+            columns.append(values[:len(indirections)].tolist() if all_live else [values[slot] for slot in live_slots])
+        # records whose latest version is in a tail page, grouped by that tail page
+        updated = [(j, slot) for j, slot in enumerate(live_slots) if indirections[slot] != rids[slot]]
+        if not updated:
+            return columns
+        tps_values = base_page.get_page(TPS_COLUMN).as_array()
+        schemas = base_page.get_page(SCHEMA_ENCODING_COLUMN).as_array()
+        updates_by_tail_page = {}
+        for j, slot in updated:
+            indirection = indirections[slot]
+            if tps_values[slot] != NULL_VALUE and tps_values[slot] >= indirection:
+                continue
+            tail_page_index, tail_page_slot_index = self._get_tail_page_indices(indirection)
+            updates_by_tail_page.setdefault(tail_page_index, []).append((j, tail_page_slot_index, schemas[slot]))
+        for tail_page_index, updates in updates_by_tail_page.items():
+            with self._get_tail(tail_page_index, sequential=True) as tail_page:
+                for values, column_index in zip(columns, column_indices):
+                    if column_index < METADATA_COLUMN_COUNT:
+                        continue
+                    updated = [(j, tail_slot) for j, tail_slot, schema in updates
+                               if self._is_field_updated(schema, column_index - METADATA_COLUMN_COUNT)]
+                    if not updated:
+                        continue
+                    tail_values = tail_page.get_page(column_index).read_many(tail_slot for _, tail_slot in updated)
+                    for (j, _), value in zip(updated, tail_values):
+                        values[j] = value
+        return columns
 
     def _print(self):
         for i in range(self._base_pages_counter):
@@ -287,7 +453,11 @@ class PageRange:
         BufferPool._write_base_page_data(index, self._page_range_data_path, basepage_bytes)
 
     def merge(self):
-        bufferpool.flush_before_merge()
+        # updates from here on may not make it into the merged pages, their values are kept
+        # apart and added to the zone maps recomputed from the merged pages
+        with self._latch:
+            self._merge_widened = {}
+        bufferpool.flush_before_merge(self._page_range_data_path)
         merged_page = BasePage(self.num_columns)
         base_pages = []
         basepage_full = dict()
@@ -308,15 +478,21 @@ class PageRange:
         for tail_page_index in reversed(range(self._tail_pages_counter)):
             index = (tail_page_index, 0)
             curr_tail_page = self.read_tailpage(index)
-            for tail_num in reversed(range(curr_tail_page.num_records)):
+            for tail_num in reversed(range(curr_tail_page.get_num_records())):
                 curr_tail_record = curr_tail_page.read_record(tail_num)
                 curr_tid = curr_tail_record[RID_COLUMN]
                 curr_base_rid = curr_tail_record[BASE_RID_COLUMN]
                 if curr_base_rid not in merged_rids and curr_base_rid != NULL_VALUE:
                     base_page_index, base_page_slot_index = self._get_base_page_indices(curr_base_rid)
+                    curr_base_page = base_pages[base_page_index]
+                    indirection = curr_base_page.get_indirection_pointer(base_page_slot_index)
+                    # tail records past the base record's indirection were undone by an abort,
+                    # or appended after the flush, and the values they hold are not committed
+                    if curr_tid > indirection:
+                        continue
                     merged_rids[curr_base_rid] = True
-                    if basepage_full[base_page_index]:
-                        curr_base_page = base_pages[base_page_index]
+                    # tail records of deleted base records are dropped instead of merged
+                    if basepage_full[base_page_index] and indirection != NULL_VALUE:
                         curr_base_page.edit_record_values(base_page_slot_index, *curr_tail_record[METADATA_COLUMN_COUNT:])
                         curr_tps = curr_base_page.get_tps(base_page_slot_index)
                         curr_base_page.update_tps(base_page_slot_index, tps_num)
@@ -332,6 +508,24 @@ class PageRange:
                 index = (base_page_index, curr_version)
                 curr_basepage = base_pages[base_page_index]
                 self.write_basepage(index, curr_basepage)
+        self._tighten_zone_maps(base_pages, basepage_full, updated_basepages)
+
+    # only full base pages are merged, their values are then the committed ones up to the merge
+    def _tighten_zone_maps(self, merged_pages, basepage_full, updated_basepages):
+        with self._latch:
+            for base_page_index, merged_page in enumerate(merged_pages):
+                zone_map = self._zone_maps[base_page_index]
+                if not basepage_full[base_page_index]:
+                    continue
+                if not updated_basepages[base_page_index] and zone_map is not None:
+                    continue
+                tight = ZoneMap.from_base_page(merged_page, self.num_columns)
+                if base_page_index in self._merge_widened:
+                    tight.union(self._merge_widened[base_page_index])
+                if zone_map is not None:
+                    tight.num_deleted = zone_map.num_deleted
+                self._zone_maps[base_page_index] = tight
+            self._merge_widened = None
 
     def __str__(self):
         s = ""
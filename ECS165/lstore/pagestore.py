@@ -0,0 +1,448 @@
+import mmap
+import os
+import sys
+from abc import ABC, abstractmethod
+from pathlib import Path
+from threading import Lock, get_ident
+from typing import Tuple
+
+# A page store persists the bytes of one column group (metadata or data columns) of a
+# base or tail page. Pages are addressed by the page range directory, the column group
+# directory inside it and the (page index, version) tuple used by the bufferpool.
+class PageStore(ABC):
+
+    @abstractmethod
+    def read(self, page_range_data_path, directory: str, index: Tuple[int, int]):
+        ...
+
+    @abstractmethod
+    def write(self, page_range_data_path, directory: str, index: Tuple[int, int], data: bytes):
+        ...
+
+    # the range methods access single pages of a column group that has already been written
+    @abstractmethod
+    def read_range(self, page_range_data_path, directory: str, index: Tuple[int, int], offset: int, length: int):
+        ...
+
+    @abstractmethod
+    def write_range(self, page_range_data_path, directory: str, index: Tuple[int, int], offset: int, data: bytes):
+        ...
+
+    @abstractmethod
+    def size(self, page_range_data_path, directory: str, index: Tuple[int, int]) -> int:
+        ...
+
+    # makes the pages written so far durable, stores that write through the OS need nothing
+    def flush(self):
+        pass
+
+    # called once the bufferpool has been flushed and emptied
+    def close(self):
+        pass
+
+class FilePageStore(PageStore):
+
+    @classmethod
+    def _index_to_filename(cls, index: Tuple[int, int]):
+        return str(index[0]) + "-" + str(index[1]) + ".bin"
+
+    def read(self, page_range_data_path, directory: str, index: Tuple[int, int]) -> bytes:
+        path = Path(page_range_data_path) / directory / self._index_to_filename(index)
+        with path.open('rb') as data_file:
+            return data_file.read()
+
+    # written to a temporary file first, so concurrent readers never see a truncated file
+    def write(self, page_range_data_path, directory: str, index: Tuple[int, int], data: bytes):
+        path = Path(page_range_data_path) / directory / self._index_to_filename(index)
+        temp_path = path.with_name(path.name + "." + str(get_ident()) + ".tmp")
+        with temp_path.open('wb') as data_file:
+            data_file.write(data)
+        os.replace(temp_path, path)
+
+    def read_range(self, page_range_data_path, directory: str, index: Tuple[int, int], offset: int, length: int) -> bytes:
+        path = Path(page_range_data_path) / directory / self._index_to_filename(index)
+        with path.open('rb') as data_file:
+            data_file.seek(offset)
+            return data_file.read(length)
+
+    def write_range(self, page_range_data_path, directory: str, index: Tuple[int, int], offset: int, data: bytes):
+        path = Path(page_range_data_path) / directory / self._index_to_filename(index)
+        with path.open('r+b') as data_file:
+            data_file.seek(offset)
+            data_file.write(data)
+
+    def size(self, page_range_data_path, directory: str, index: Tuple[int, int]) -> int:
+        path = Path(page_range_data_path) / directory / self._index_to_filename(index)
+        return path.stat().st_size
+
+# One memory-mapped segment file per column group and version. Page i of the group lives
+# in slot i of the segment, so reads return memoryview slices of the mapping and need no
+# open/close per page.
+class MmapPageStore(PageStore):
+
+    def __init__(self):
+        self._segments = {}
+        self._latch = Lock()
+
+    def _get_segment(self, page_range_data_path, directory: str, version: int):
+        key = (str(page_range_data_path), directory, version)
+        segment = self._segments.get(key)
+        if segment is None:
+            with self._latch:
+                segment = self._segments.get(key)
+                if segment is None:
+                    path = Path(page_range_data_path) / directory / (str(version) + ".seg")
+                    segment = MappedSegment(path)
+                    self._segments[key] = segment
+        return segment
+
+    def read(self, page_range_data_path, directory: str, index: Tuple[int, int]) -> memoryview:
+        return self._get_segment(page_range_data_path, directory, index[1]).read(index[0])
+
+    def write(self, page_range_data_path, directory: str, index: Tuple[int, int], data: bytes):
+        self._get_segment(page_range_data_path, directory, index[1]).write(index[0], data)
+
+    def read_range(self, page_range_data_path, directory: str, index: Tuple[int, int], offset: int, length: int) -> memoryview:
+        return self.read(page_range_data_path, directory, index)[offset:offset + length]
+
+    def write_range(self, page_range_data_path, directory: str, index: Tuple[int, int], offset: int, data: bytes):
+        self.read(page_range_data_path, directory, index)[offset:offset + len(data)] = data
+
+    def size(self, page_range_data_path, directory: str, index: Tuple[int, int]) -> int:
+        return len(self.read(page_range_data_path, directory, index))
+
+    def flush(self):
+        with self._latch:
+            segments = list(self._segments.values())
+        for segment in segments:
+            segment.flush()
+
+    def close(self):
+        with self._latch:
+            segments = list(self._segments.values())
+            # dropped tables may be deleted and recreated, so segments are reopened on next use
+            self._segments.clear()
+        for segment in segments:
+            segment.close()
+
+# The header holds the slot size, so a segment can be read back without knowing the table
+# schema, and the segment format. Each slot starts with a mark that is set once the slot has
+# been written, so reads of slots that were only allocated by growing the file fail. Segments
+# of format 0 have no marks and every slot within their size reads as written.
+class MappedSegment:
+
+    HEADER_SIZE = mmap.ALLOCATIONGRANULARITY
+    FORMAT_VERSION = 1
+    INITIAL_SLOTS = 4
+    WRITTEN_MARK = b"\xff" * 8
+
+    def __init__(self, path):
+        self._path = Path(path)
+        self._latch = Lock()
+        self._mmap = None
+        # mappings replaced by a larger one, closed once no page uses them anymore
+        self._retired_mmaps = []
+        self._slot_size = 0
+        self._mark_size = len(self.WRITTEN_MARK)
+        self._dirty = False
+        if self._path.exists():
+            with self._path.open('rb') as segment_file:
+                header = segment_file.read(16)
+            self._slot_size = int.from_bytes(header[:8], "big")
+            if int.from_bytes(header[8:16], "big") == 0:
+                self._mark_size = 0
+            self._map()
+
+    def _map(self):
+        with self._path.open('r+b') as segment_file:
+            # the mapping stays valid after the file is closed
+            new_mmap = mmap.mmap(segment_file.fileno(), 0)
+        if self._mmap is not None:
+            self._retired_mmaps.append(self._mmap)
+        self._mmap = new_mmap
+        self._close_retired_mmaps()
+
+    # pages loaded from a retired mapping hold memoryviews of it until they are evicted or
+    # first written, mappings that still have views are retried on the next remap or close
+    def _close_retired_mmaps(self):
+        still_used = []
+        for retired_mmap in self._retired_mmaps:
+            try:
+                retired_mmap.close()
+            except BufferError:
+                still_used.append(retired_mmap)
+        self._retired_mmaps = still_used
+
+    def _offset(self, slot: int) -> int:
+        return self.HEADER_SIZE + slot * (self._mark_size + self._slot_size) + self._mark_size
+
+    def _ensure_capacity(self, slot: int):
+        required_size = self._offset(slot) + self._slot_size
+        if self._mmap is not None and len(self._mmap) >= required_size:
+            return
+        if self._mmap is None:
+            with self._path.open('wb') as segment_file:
+                segment_file.write(self._slot_size.to_bytes(8, "big") + self.FORMAT_VERSION.to_bytes(8, "big"))
+        size = self._offset(self.INITIAL_SLOTS) - self._mark_size if self._mmap is None else len(self._mmap)
+        while size < required_size:
+            size = self.HEADER_SIZE + 2 * (size - self.HEADER_SIZE)
+        os.truncate(self._path, size)
+        self._map()
+
+    def _is_written(self, slot: int) -> bool:
+        offset = self._offset(slot)
+        if self._mmap is None or offset + self._slot_size > len(self._mmap):
+            return False
+        return self._mmap[offset - self._mark_size:offset] == self.WRITTEN_MARK[:self._mark_size]
+
+    def read(self, slot: int) -> memoryview:
+        assert self._is_written(slot), "Page not in segment: " + str(self._path) + " slot " + str(slot)
+        offset = self._offset(slot)
+        return memoryview(self._mmap)[offset:offset + self._slot_size]
+
+    def write(self, slot: int, data: bytes):
+        with self._latch:
+            if self._slot_size == 0:
+                self._slot_size = len(data)
+            assert len(data) == self._slot_size, "Unequal page group size" + str(len(data))
+            self._ensure_capacity(slot)
+            offset = self._offset(slot)
+            self._mmap[offset:offset + self._slot_size] = data
+            self._mmap[offset - self._mark_size:offset] = self.WRITTEN_MARK[:self._mark_size]
+            self._dirty = True
+
+    # only segments written since their last flush are synced
+    def flush(self):
+        with self._latch:
+            if self._mmap is not None and self._dirty:
+                self._mmap.flush()
+                self._dirty = False
+
+    def close(self):
+        self.flush()
+        with self._latch:
+            if self._mmap is not None:
+                self._retired_mmaps.append(self._mmap)
+                self._mmap = None
+            self._close_retired_mmaps()
+
+# One append-only segment file per page range holding every page of every column group.
+# The file starts with a format header and each page is stored as a block header naming
+# its column group, page index and version, followed by the page bytes. Rewrites of an
+# existing page go to the same offset, new pages and versions are appended.
+#
+# Closing a segment appends a page table block holding the header and data offset of every
+# page, which ends with its own offset and a magic number, so a segment that was closed is
+# opened with a single read of its table. Otherwise the block headers are scanned, and a
+# block cut short by a crash at the end of the file is truncated away.
+class SegmentPageStore(PageStore):
+
+    def __init__(self):
+        self._segments = {}
+        self._latch = Lock()
+
+    def _get_segment(self, page_range_data_path):
+        key = str(page_range_data_path)
+        segment = self._segments.get(key)
+        if segment is None:
+            with self._latch:
+                segment = self._segments.get(key)
+                if segment is None:
+                    segment = PageSegment(Path(page_range_data_path) / PageSegment.FILE_NAME)
+                    self._segments[key] = segment
+        return segment
+
+    def read(self, page_range_data_path, directory: str, index: Tuple[int, int]) -> bytes:
+        return self._get_segment(page_range_data_path).read(directory, index)
+
+    def write(self, page_range_data_path, directory: str, index: Tuple[int, int], data: bytes):
+        self._get_segment(page_range_data_path).write(directory, index, data)
+
+    def read_range(self, page_range_data_path, directory: str, index: Tuple[int, int], offset: int, length: int) -> bytes:
+        return self._get_segment(page_range_data_path).read(directory, index, offset, length)
+
+    def write_range(self, page_range_data_path, directory: str, index: Tuple[int, int], offset: int, data: bytes):
+        self._get_segment(page_range_data_path).write_range(directory, index, offset, data)
+
+    def size(self, page_range_data_path, directory: str, index: Tuple[int, int]) -> int:
+        return self._get_segment(page_range_data_path).size(directory, index)
+
+    def close(self):
+        with self._latch:
+            segments = list(self._segments.values())
+            self._segments.clear()
+        for segment in segments:
+            segment.close()
+
+class PageSegment:
+
+    FILE_NAME = "pages.seg"
+    MAGIC = b"LSTORSEG"
+    FORMAT_VERSION = 1
+    FILE_HEADER_SIZE = 16
+    # column group name, page index, version, length
+    GROUP_NAME_SIZE = 24
+    BLOCK_HEADER_SIZE = GROUP_NAME_SIZE + 3 * 8
+    # page table blocks use a group name no column group directory has
+    PAGE_TABLE_GROUP = "#pages"
+    PAGE_TABLE_MAGIC = b"LSTORPGT"
+    PAGE_TABLE_ENTRY_SIZE = BLOCK_HEADER_SIZE + 8
+    PAGE_TABLE_TRAILER_SIZE = 16
+
+    def __init__(self, path):
+        self._path = Path(path)
+        self._latch = Lock()
+        self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+        # (column group, page index, version) -> (data offset, length)
+        self._pages = {}
+        self._end = os.fstat(self._fd).st_size
+        # true while the file ends with a page table of every page in it
+        self._page_table_written = False
+        if self._end == 0:
+            header = self.MAGIC + self.FORMAT_VERSION.to_bytes(8, "big")
+            os.pwrite(self._fd, header, 0)
+            self._end = self.FILE_HEADER_SIZE
+        else:
+            header = os.pread(self._fd, self.FILE_HEADER_SIZE, 0)
+            assert header[:8] == self.MAGIC, "Not a page segment: " + str(self._path)
+            assert int.from_bytes(header[8:], "big") == self.FORMAT_VERSION, \
+                "Unsupported segment format: " + str(self._path)
+            self._page_table_written = self._read_page_table()
+            if not self._page_table_written:
+                self._scan_blocks()
+
+    # returns False if the file does not end with a complete page table
+    def _read_page_table(self) -> bool:
+        if self._end < self.FILE_HEADER_SIZE + self.BLOCK_HEADER_SIZE + self.PAGE_TABLE_TRAILER_SIZE:
+            return False
+        trailer = os.pread(self._fd, self.PAGE_TABLE_TRAILER_SIZE, self._end - self.PAGE_TABLE_TRAILER_SIZE)
+        offset = int.from_bytes(trailer[:8], "big")
+        if trailer[8:] != self.PAGE_TABLE_MAGIC or not self.FILE_HEADER_SIZE <= offset < self._end:
+            return False
+        block = os.pread(self._fd, self._end - offset, offset)
+        group, _, length = self._decode_block_header(block[:self.BLOCK_HEADER_SIZE])
+        if group != self.PAGE_TABLE_GROUP or offset + self.BLOCK_HEADER_SIZE + length != self._end:
+            return False
+        entries = block[self.BLOCK_HEADER_SIZE:-self.PAGE_TABLE_TRAILER_SIZE]
+        for i in range(0, len(entries), self.PAGE_TABLE_ENTRY_SIZE):
+            group, index, length = self._decode_block_header(entries[i:i + self.BLOCK_HEADER_SIZE])
+            data_offset = int.from_bytes(entries[i + self.BLOCK_HEADER_SIZE:i + self.PAGE_TABLE_ENTRY_SIZE], "big")
+            self._pages[(group,) + index] = (data_offset, length)
+        return True
+
+    def _scan_blocks(self):
+        offset = self.FILE_HEADER_SIZE
+        while offset < self._end:
+            block_header = os.pread(self._fd, self.BLOCK_HEADER_SIZE, offset)
+            try:
+                group, index, length = self._decode_block_header(block_header)
+            except UnicodeDecodeError:
+                break
+            if len(block_header) < self.BLOCK_HEADER_SIZE or not group or offset + self.BLOCK_HEADER_SIZE + length > self._end:
+                break
+            # page tables of earlier sessions are skipped, the blocks hold the same pages
+            if group != self.PAGE_TABLE_GROUP:
+                self._pages[(group,) + index] = (offset + self.BLOCK_HEADER_SIZE, length)
+            offset += self.BLOCK_HEADER_SIZE + length
+        if offset < self._end:
+            # the last block was cut short while being appended
+            os.ftruncate(self._fd, offset)
+            self._end = offset
+
+    def _write_page_table(self):
+        entries = [self._encode_block_header(key[0], key[1:], length) + data_offset.to_bytes(8, "big")
+                   for key, (data_offset, length) in self._pages.items()]
+        entries.append(self._end.to_bytes(8, "big") + self.PAGE_TABLE_MAGIC)
+        data = b"".join(entries)
+        block_header = self._encode_block_header(self.PAGE_TABLE_GROUP, (0, 0), len(data))
+        os.pwrite(self._fd, block_header + data, self._end)
+        self._end += self.BLOCK_HEADER_SIZE + len(data)
+        self._page_table_written = True
+
+    def _encode_block_header(self, group: str, index: Tuple[int, int], length: int) -> bytes:
+        name = group.encode()
+        assert len(name) <= self.GROUP_NAME_SIZE, "Column group name too long: " + group
+        return name.ljust(self.GROUP_NAME_SIZE, b"\0") + index[0].to_bytes(8, "big") \
+            + index[1].to_bytes(8, "big") + length.to_bytes(8, "big")
+
+    def _decode_block_header(self, block_header: bytes):
+        group = block_header[:self.GROUP_NAME_SIZE].rstrip(b"\0").decode()
+        fields = block_header[self.GROUP_NAME_SIZE:]
+        index = (int.from_bytes(fields[0:8], "big"), int.from_bytes(fields[8:16], "big"))
+        length = int.from_bytes(fields[16:24], "big")
+        return group, index, length
+
+    def _locate(self, group: str, index: Tuple[int, int]):
+        location = self._pages.get((group,) + tuple(index))
+        assert location is not None, "Page not in segment: " + group + " " + str(index)
+        return location
+
+    # offset and length select part of the page group, the whole group is read by default
+    def read(self, group: str, index: Tuple[int, int], offset: int = 0, length: int = None) -> bytes:
+        data_offset, data_length = self._locate(group, index)
+        if length is None:
+            length = data_length - offset
+        assert offset + length <= data_length, "Read past the end of " + group + " " + str(index)
+        return os.pread(self._fd, length, data_offset + offset)
+
+    def write_range(self, group: str, index: Tuple[int, int], offset: int, data: bytes):
+        data_offset, data_length = self._locate(group, index)
+        assert offset + len(data) <= data_length, "Write past the end of " + group + " " + str(index)
+        os.pwrite(self._fd, data, data_offset + offset)
+
+    def size(self, group: str, index: Tuple[int, int]) -> int:
+        return self._locate(group, index)[1]
+
+    def write(self, group: str, index: Tuple[int, int], data: bytes):
+        key = (group,) + tuple(index)
+        with self._latch:
+            location = self._pages.get(key)
+            if location is not None and location[1] == len(data):
+                os.pwrite(self._fd, data, location[0])
+                return
+            block_header = self._encode_block_header(group, index, len(data))
+            os.pwrite(self._fd, block_header + data, self._end)
+            self._pages[key] = (self._end + self.BLOCK_HEADER_SIZE, len(data))
+            self._end += self.BLOCK_HEADER_SIZE + len(data)
+            self._page_table_written = False
+
+    def close(self):
+        with self._latch:
+            if not self._page_table_written:
+                self._write_page_table()
+            os.close(self._fd)
+
+
+# Offline conversion from the file per page layout of FilePageStore to SegmentPageStore.
+# Every "{index}-{version}.bin" file in the column group directories of each page range of
+# each table is copied into the page range's segment file. The .bin files are left in place.
+def convert_database_to_segments(database_path):
+    for table_path in Path(database_path).iterdir():
+        if table_path.is_dir():
+            convert_table_to_segments(table_path)
+
+def convert_table_to_segments(table_path):
+    for page_range_path in Path(table_path).iterdir():
+        if page_range_path.is_dir() and page_range_path.name.isdigit():
+            convert_page_range_to_segment(page_range_path)
+
+def convert_page_range_to_segment(page_range_path):
+    page_range_path = Path(page_range_path)
+    segment = PageSegment(page_range_path / PageSegment.FILE_NAME)
+    try:
+        for group_path in sorted(page_range_path.iterdir()):
+            if not group_path.is_dir():
+                continue
+            for page_path in sorted(group_path.glob("*.bin")):
+                page_index, version = page_path.stem.split("-")
+                with page_path.open('rb') as page_file:
+                    segment.write(group_path.name, (int(page_index), int(version)), page_file.read())
+    finally:
+        segment.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("usage: python -m lstore.pagestore <database path>")
+        sys.exit(1)
+    convert_database_to_segments(sys.argv[1])
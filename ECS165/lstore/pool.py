@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from time import time
 from threading import Lock
 from typing import Tuple
@@ -8,66 +8,85 @@ from lstore.heapdict import heapdict
 
 Frame = namedtuple("Frame", ["base_page", "index", "page_range_data_path", "is_base"])
 
+# sequential marks accesses made by full scans. Policies that care about scan
+# resistance use it to keep scanned pages from displacing the working set.
 class Pool(ABC):
 
     @abstractmethod
-    def add_frame(self, pinnable_base_page, index: int, page_range_data_path, is_base: bool):
+    def add_frame(self, pinnable_base_page, index: int, page_range_data_path, is_base: bool, sequential: bool = False):
         ...
 
     @abstractmethod
-    def get_frame(self, index: int, page_range_data_path):
+    def get_frame(self, index: int, page_range_data_path, is_base: bool, sequential: bool = False):
         ...
 
+    # returns None if allow_dirty is False and every unpinned frame is dirty
     @abstractmethod
-    def evict_frame(self):
+    def evict_frame(self, allow_dirty: bool = True):
         ...
 
     @abstractmethod
     def is_full(self):
         ...
 
+    @classmethod
+    def _frame_key(cls, index: Tuple[int,int], page_range_data_path, is_base: bool):
+        return (page_range_data_path, is_base, index)
+
 class PrioritizedPool(Pool, ABC):
 
     def __init__(self, max_size):
         self._pool = heapdict()
+        # (page_range_data_path, is_base, index) -> frame, kept in sync with self._pool
+        self._frames = {}
         self._max_size = max_size
         self._latch = Lock()
 
-    def add_frame(self, pinnable_base_page, index: Tuple[int,int], page_range_data_path, is_base: bool):
+    def add_frame(self, pinnable_base_page, index: Tuple[int,int], page_range_data_path, is_base: bool, sequential: bool = False):
         with self._latch:
+            key = self._frame_key(index, page_range_data_path, is_base)
+            # another thread may have loaded the same page while we were reading it
+            if key in self._frames:
+                return self._frames[key]
             assert not self.is_full()
             frame = Frame(pinnable_base_page, index, page_range_data_path, is_base)
             self._pool[frame] = self.get_new_frame_priority()
+            self._frames[key] = frame
             return frame
 
-    def get_frame(self, index: Tuple[int,int], page_range_data_path, is_base: bool):
+    def get_frame(self, index: Tuple[int,int], page_range_data_path, is_base: bool, sequential: bool = False):
         with self._latch:
-            for frame in self._pool:
-                if frame.index == index and frame.page_range_data_path == page_range_data_path and frame.is_base == is_base:
-                    self._pool[frame] = self.get_frame_priority(self._pool[frame])
-                    return frame.base_page
-            return None
+            frame = self._frames.get(self._frame_key(index, page_range_data_path, is_base))
+            if frame is None:
+                return None
+            self._pool[frame] = self.get_frame_priority(self._pool[frame])
+            return frame.base_page
 
-    def evict_frame(self):
+    def evict_frame(self, allow_dirty: bool = True):
         with self._latch:
             assert self.is_full()
-            pinned_frames = []
+            skipped_frames = []
+            victim = None
             for i in range(len(self._pool)):
                 frame, priority = self._pool.popitem()
-                if not frame.base_page.is_pinned():
+                if frame.base_page.try_evict(allow_dirty):
+                    victim = frame
                     break
-                pinned_frames.append((frame, priority))
-            assert not frame.base_page.is_pinned(), "Increase BufferPool Size!"
-            for frame, priority in pinned_frames:
+                skipped_frames.append((frame, priority))
+            for frame, priority in skipped_frames:
                 self._pool[frame] = priority
-            return frame
+            if victim is None:
+                assert not allow_dirty, "Increase BufferPool Size!"
+                return None
+            del self._frames[self._frame_key(victim.index, victim.page_range_data_path, victim.is_base)]
+            return victim
 
     def is_full(self):
         return len(self._pool) >= self._max_size
 
     def __iter__(self):
         with self._latch:
-            return iter(self._pool)
+            return iter(list(self._pool))
 
     @abstractmethod
     def get_new_frame_priority(self):
@@ -120,3 +139,218 @@ class LIFOPool(PrioritizedPool):
 
     def get_frame_priority(self, old_priority):
         return old_priority
+
+class ClockPool(Pool):
+
+    def __init__(self, max_size):
+        self._max_size = max_size
+        # circular buffer of frames swept by the clock hand, None marks a free slot
+        self._ring = [None] * max_size
+        self._referenced = bytearray(max_size)
+        self._free_slots = list(reversed(range(max_size)))
+        # (page_range_data_path, is_base, index) -> (slot, frame)
+        self._slots = {}
+        self._hand = 0
+        self._latch = Lock()
+
+    def add_frame(self, pinnable_base_page, index: Tuple[int,int], page_range_data_path, is_base: bool, sequential: bool = False):
+        with self._latch:
+            key = self._frame_key(index, page_range_data_path, is_base)
+            if key in self._slots:
+                return self._slots[key][1]
+            assert not self.is_full()
+            frame = Frame(pinnable_base_page, index, page_range_data_path, is_base)
+            slot = self._free_slots.pop()
+            self._ring[slot] = frame
+            # scanned pages start unreferenced so they are the first to go
+            self._referenced[slot] = 0 if sequential else 1
+            self._slots[key] = (slot, frame)
+            self._on_add(slot, key, sequential)
+            return frame
+
+    # hits only set the reference bit, the latch is taken by add and evict only
+    def get_frame(self, index: Tuple[int,int], page_range_data_path, is_base: bool, sequential: bool = False):
+        entry = self._slots.get(self._frame_key(index, page_range_data_path, is_base))
+        if entry is None:
+            return None
+        slot, frame = entry
+        if not sequential:
+            self._referenced[slot] = 1
+        return frame.base_page
+
+    def evict_frame(self, allow_dirty: bool = True):
+        with self._latch:
+            assert self.is_full()
+            # every frame gets its reference bit cleared on the first lap, so a victim is
+            # normally found within two laps. Hits set bits without the latch and can keep
+            # setting them, so the last lap takes any frame that can be evicted.
+            for lap in range(3):
+                for _ in range(self._max_size):
+                    slot = self._hand
+                    self._hand = (self._hand + 1) % self._max_size
+                    frame = self._ring[slot]
+                    if frame is None or frame.base_page.is_pinned():
+                        continue
+                    if not allow_dirty and frame.base_page.is_dirty():
+                        continue
+                    if (lap == 2 or self._is_victim(slot)) and frame.base_page.try_evict(allow_dirty):
+                        key = self._frame_key(frame.index, frame.page_range_data_path, frame.is_base)
+                        self._ring[slot] = None
+                        self._referenced[slot] = 0
+                        self._free_slots.append(slot)
+                        del self._slots[key]
+                        self._on_evict(slot, key)
+                        return frame
+            assert not allow_dirty, "Increase BufferPool Size!"
+            return None
+
+    def is_full(self):
+        return len(self._slots) >= self._max_size
+
+    def __iter__(self):
+        with self._latch:
+            return iter([frame for _, frame in self._slots.values()])
+
+    def _is_victim(self, slot):
+        if self._referenced[slot]:
+            self._referenced[slot] = 0
+            return False
+        return True
+
+    def _on_add(self, slot, key, sequential):
+        pass
+
+    def _on_evict(self, slot, key):
+        pass
+
+# Simplified CLOCK-Pro: pages enter cold and are only promoted to hot when they are
+# referenced again before the hand comes back around. Only cold pages are evicted,
+# so a single sequential scan cycles through the cold frames without displacing the
+# hot working set. Recently evicted cold pages are remembered as non-resident test
+# entries and are admitted hot if they are requested again.
+class ClockProPool(ClockPool):
+
+    def __init__(self, max_size, hot_fraction=0.75):
+        super().__init__(max_size)
+        self._hot = bytearray(max_size)
+        self._hot_count = 0
+        self._max_hot = max(1, int(max_size * hot_fraction))
+        self._test_keys = OrderedDict()
+
+    def _on_add(self, slot, key, sequential):
+        # new pages should not jump the queue through their first reference
+        self._referenced[slot] = 0
+        in_test_period = self._test_keys.pop(key, None) is not None
+        if in_test_period and not sequential and self._hot_count < self._max_hot:
+            self._hot[slot] = 1
+            self._hot_count += 1
+
+    def _on_evict(self, slot, key):
+        # only the last lap of a sweep evicts hot pages
+        if self._hot[slot]:
+            self._hot[slot] = 0
+            self._hot_count -= 1
+        self._test_keys[key] = True
+        if len(self._test_keys) > self._max_size:
+            self._test_keys.popitem(last=False)
+
+    def _is_victim(self, slot):
+        referenced = self._referenced[slot]
+        self._referenced[slot] = 0
+        if self._hot[slot]:
+            if not referenced:
+                self._hot[slot] = 0
+                self._hot_count -= 1
+            return False
+        if referenced:
+            if self._hot_count < self._max_hot:
+                self._hot[slot] = 1
+                self._hot_count += 1
+            return False
+        return True
+
+# 2Q: pages are admitted to a short FIFO probationary queue and only enter the
+# protected LRU queue when they are requested again after being evicted from
+# probation (tracked by the ghost queue of recently evicted keys). Pages read by
+# sequential scans are never remembered as ghosts, so a scan only ever cycles
+# through the probationary queue.
+class TwoQueuePool(Pool):
+
+    def __init__(self, max_size, probation_fraction=0.25, ghost_fraction=0.5):
+        self._max_size = max_size
+        self._max_probation = max(1, int(max_size * probation_fraction))
+        self._max_ghosts = max(1, int(max_size * ghost_fraction))
+        self._probation = OrderedDict()
+        self._protected = OrderedDict()
+        self._ghosts = OrderedDict()
+        # keys in probation that have only been touched by scans
+        self._scanned = set()
+        self._latch = Lock()
+
+    def add_frame(self, pinnable_base_page, index: Tuple[int,int], page_range_data_path, is_base: bool, sequential: bool = False):
+        with self._latch:
+            key = self._frame_key(index, page_range_data_path, is_base)
+            frame = self._probation.get(key) or self._protected.get(key)
+            if frame is not None:
+                return frame
+            assert not self.is_full()
+            frame = Frame(pinnable_base_page, index, page_range_data_path, is_base)
+            if not sequential and self._ghosts.pop(key, None) is not None:
+                self._protected[key] = frame
+            else:
+                self._probation[key] = frame
+                if sequential:
+                    self._scanned.add(key)
+            return frame
+
+    def get_frame(self, index: Tuple[int,int], page_range_data_path, is_base: bool, sequential: bool = False):
+        with self._latch:
+            key = self._frame_key(index, page_range_data_path, is_base)
+            frame = self._protected.get(key)
+            if frame is not None:
+                if not sequential:
+                    self._protected.move_to_end(key)
+                return frame.base_page
+            frame = self._probation.get(key)
+            if frame is None:
+                return None
+            # correlated references inside probation do not promote the page
+            if not sequential:
+                self._scanned.discard(key)
+            return frame.base_page
+
+    def _pop_unpinned(self, queue, allow_dirty):
+        for key, frame in queue.items():
+            if frame.base_page.try_evict(allow_dirty):
+                del queue[key]
+                return key, frame
+        return None, None
+
+    def evict_frame(self, allow_dirty: bool = True):
+        with self._latch:
+            assert self.is_full()
+            queues = [self._probation, self._protected]
+            if len(self._probation) < self._max_probation:
+                queues.reverse()
+            for queue in queues:
+                key, frame = self._pop_unpinned(queue, allow_dirty)
+                if frame is not None:
+                    break
+            if frame is None:
+                assert not allow_dirty, "Increase BufferPool Size!"
+                return None
+            if queue is self._probation:
+                if key in self._scanned:
+                    self._scanned.remove(key)
+                else:
+                    self._ghosts[key] = True
+                    if len(self._ghosts) > self._max_ghosts:
+                        self._ghosts.popitem(last=False)
+            return frame
+
+    def is_full(self):
+        return len(self._probation) + len(self._protected) >= self._max_size
+
+    def __iter__(self):
+        with self._latch:
+            return iter(list(self._probation.values()) + list(self._protected.values()))
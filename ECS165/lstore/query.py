@@ -1,7 +1,10 @@
+from array import array
+from itertools import islice
 from threading import Lock
 from lstore.config import *
 from lstore.table import *
 from lstore.index import *
+from lstore.aggregate import aggregate
 
 
 class Query:
@@ -40,22 +43,14 @@ class Query:
             return False
         record = self.table.read_record(rid)
         self.table.delete_record(rid) 
+        self.table.index.delete_composite(rid, record.columns)
         
         i = 0
         while i < len(record.columns):
             if self.table.index.indices[i]:
-                record_node = self.table.index.indices[i].search_tree(record.columns[i])
-                if record_node is None:
+                if self.table.index.indices[i].search_tree(record.columns[i]) is None:
                     return False
-                rid_list = record_node[1].keys[record_node[0]]
-                
-                if rid_list is None:
-                    return False
-                rid_list = rid_list[1]
-                if len(rid_list) == 1:
-                    self.table.index.indices[i].delete_in_tree(record_node[1],[record.columns[i],rid])
-                elif len(rid_list)>1:
-                    self.table.index.indices[i].mini_delete(record.columns[i],rid)
+                self.table.index.remove_rid(i, record.columns[i], rid)
             i = i+1
 
         return True
@@ -81,42 +76,125 @@ class Query:
         rid = self.table.append_record(*columns)
         i = 0
         while i < len(columns):
-            index_key = [columns[i], [rid]]
-            if self.table.index.indices[i] is not None:
-                self.table.index.indices[i].insert_to_tree(index_key)
+            self.table.index.insert_rid(i, columns[i], rid)
             i = i + 1
+        self.table.index.insert_composite(rid, columns)
+        return True
+
+    """
+    # Insert many records at once, either as a sequence of rows or as one sequence per column
+    # Fills whole base pages at a time and updates each index once per distinct value
+    # Return True upon succesful insertion
+    # Returns False if insert fails for whatever reason
+    """
+
+    def insert_many(self, rows):
+        rows = list(rows)
+        if not rows:
+            return True
+        if any(len(row) != self.table.num_columns for row in rows):
+            return False
+        return self.insert_columns(*[list(column) for column in zip(*rows)])
+
+    def insert_columns(self, *columns):
+        if len(columns) != self.table.num_columns:
+            return False
+        columns = [list(column) for column in columns]
+        if len(set(len(column) for column in columns)) != 1:
+            return False
+        for column in columns:
+            if None in column or not list_validate(column):
+                return False
+        if not columns[0]:
+            return True
+        rids = self.table.append_records(columns)
+        for i in range(len(columns)):
+            if self.table.index.indices[i] is not None:
+                self.table.index.insert_many(i, columns[i], rids)
+        self.table.index.insert_composite_many(rids, zip(*columns))
         return True
 
     """
     # Read a record with specified key
-    # :param key: the key value to select records based on
+    # :param key: the key value to select records based on, a tuple of values if column is a tuple of columns
     # :param query_columns: what columns to return. array of 1 or 0 values.
     # Returns a list of Record objects upon success
     # Returns False if record locked by TPL
     # Assume that select will never be called on a key that doesn't exist
+    # Selects covered by a composite index are answered from the index without reading the records
     """
 
     def select(self, key, column, query_columns):
-        if self.table.index.indices[column] is None:
-            self.table.index.create_index(column)
+        covered = self.table.index.select_covered(column, key, query_columns)
+        if covered is not None:
+            return [Record(rid, self.table.key, columns) for rid, columns in covered] or False
 
         rids = self.table.index.locate(column, key)
         record_list = []
         if rids is False or rids is None or rids == []:
             return False
 
-        for i in rids:
-            temp = self.table.read_record(i)
-            for j in range(len(query_columns)):
-                if query_columns[j] == 0:
-                    temp.columns[j] = None
-            record_list.append(temp)
+        if len(rids) == 1:
+            record_list.append(self.table.read_record(rids[0], query_columns))
+        else:
+            # many matches are read a page at a time
+            projected = [i for i, query in enumerate(query_columns) if query]
+            record_list = self._build_records(self.table.read_columns_many(rids, projected), projected, query_columns)
 
         if record_list == []:
             return False
         else:
             return record_list
 
+    """
+    # Streams the records select would return in batches of batch_size, reading the pages of a batch
+    # at a time and holding no pins between batches, so a caller may stop at any point
+    # :param batch_size: int    # records per batch, must be positive
+    # :param columnar: bool     # yield one array per column instead of Record objects, None for columns not queried
+    # Records deleted after they were located are skipped
+    """
+
+    def select_cursor(self, key, column, query_columns, batch_size=CURSOR_BATCH_SIZE, columnar=False):
+        assert batch_size > 0, \
+            "batch_size must be positive: " + str(batch_size)
+        projected = [i for i, query in enumerate(query_columns) if query]
+        covered = self.table.index.select_covered(column, key, query_columns)
+        if covered is not None:
+            # the index reads the covered rows of a batch only once the batch is taken
+            rows = ((rid, [columns[i] for i in projected]) for rid, columns in covered)
+            batches = _batches(rows, batch_size)
+        else:
+            rids = self.table.index.locate(column, key) or ()
+            batches = (self.table.read_columns_many(batch, projected) for batch in _batches(rids, batch_size))
+        return self._yield_batches(batches, projected, query_columns, columnar)
+
+    def _yield_batches(self, batches, projected, query_columns, columnar):
+        for rows in batches:
+            if not rows:
+                continue
+            if columnar:
+                batch = [None] * len(query_columns)
+                for j, i in enumerate(projected):
+                    batch[i] = array('Q', [values[j] for _, values in rows])
+                yield batch
+            else:
+                yield self._build_records(rows, projected, query_columns)
+
+    # rows are (rid, values of the projected columns) pairs
+    def _build_records(self, rows, projected, query_columns):
+        records = []
+        key = self.table.key
+        if len(projected) == len(query_columns):
+            for rid, values in rows:
+                records.append(Record(rid, key, values))
+            return records
+        for rid, values in rows:
+            columns = [None] * len(query_columns)
+            for i, value in zip(projected, values):
+                columns[i] = value
+            records.append(Record(rid, key, columns))
+        return records
+
     """
     # Update a record with specified key and columns
     # Returns True if update is succesful
@@ -147,9 +225,10 @@ class Query:
         i = 0
         while i < len(columns):
             if self.table.index.indices[i] is not None:
-                if past_record.columns[i]!=columns[i]:
-                    self.table.index.indices[i].update_tree(past_record.columns[i], rid, columns[i])
+                if columns[i] != NULL_VALUE and past_record.columns[i] != columns[i]:
+                    self.table.index.move_rid(i, past_record.columns[i], rid, columns[i])
             i = i + 1
+        self.table.index.update_composite(rid, past_record.columns, columns)
         return True
 
     """
@@ -162,17 +241,38 @@ class Query:
     """
 
     def sum(self, start_range, end_range, aggregate_column_index):
+        return self.aggregate("sum", start_range, end_range, aggregate_column_index)
 
-        if self.table.index.indices[self.table.key] is None:
-            self.table.index.create_index(self.table.key)
-        summation = 0
-        locations = self.table.index.locate_range(start_range, end_range, self.table.key)
-        if locations == []:
-            return False
+    """
+    # Same as sum with the count, minimum, maximum or average of the column
+    """
+
+    def count(self, start_range, end_range, aggregate_column_index):
+        return self.aggregate("count", start_range, end_range, aggregate_column_index)
 
-        for i in locations:
-            summation = summation + self.table.get_field(aggregate_column_index, i)
-        return summation
+    def min(self, start_range, end_range, aggregate_column_index):
+        return self.aggregate("min", start_range, end_range, aggregate_column_index)
+
+    def max(self, start_range, end_range, aggregate_column_index):
+        return self.aggregate("max", start_range, end_range, aggregate_column_index)
+
+    def avg(self, start_range, end_range, aggregate_column_index):
+        return self.aggregate("avg", start_range, end_range, aggregate_column_index)
+
+    """
+    :param function: str                # One of "sum", "count", "min", "max" or "avg"
+    :param group_by_column_index: int   # Optional column to group the records by
+    # Aggregates the column over the records with primary keys in the given range, reading a base page at a time
+    # Returns a dict from each value of the group by column to its aggregate if one is given
+    # Returns False if no record exists in the given range
+    """
+
+    def aggregate(self, function, start_range, end_range, aggregate_column_index, group_by_column_index=None):
+        result = aggregate(self.table, function, aggregate_column_index, start_range, end_range,
+                           self.table.key, group_by_column_index)
+        if result is None:
+            return False
+        return result
 
     """
     incremenets one column of the record
@@ -191,3 +291,13 @@ class Query:
             u = self.update(key, *updated_columns)
             return u
         return False
+
+
+# yields lists of up to size consecutive items of iterable, taking only the items of each list
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
@@ -1,6 +1,6 @@
 from pathlib import Path
 from threading import Lock
-from typing import Sequence, Iterator, List
+from typing import Sequence, Iterator, List, Tuple
 import os
 import queue, threading
 
@@ -10,12 +10,21 @@ from lstore.index import Index
 from lstore.pagedirectory import PageDirectory
 
 
+# slotted since selects and scans create one per row
 class Record:
+    __slots__ = ("rid", "key", "columns")
+
     def __init__(self, rid, key, columns):
         self.rid = rid
         self.key = key
         self.columns = columns
 
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def __len__(self):
+        return len(self.columns)
+
     def __str__(self):
         return str(self.columns)
 
@@ -85,6 +94,20 @@ class Table:
             self._next_rid += 1
             return self._next_rid - 1
 
+    # columns holds one list of values per data column, returns the rids of the new records
+    def append_records(self, columns: Sequence[Sequence[int]]) -> range:
+        with self._latch:
+            first_rid = self._next_rid
+            total = len(columns[0])
+            appended = 0
+            while appended < total:
+                if self._get_current_page_range().is_full():
+                    self._create_new_page_range()
+                batch = [column[appended:appended + RECORDS_PER_PAGE_RANGE] for column in columns]
+                appended += self._get_current_page_range().append_records(self._next_rid, batch)
+                self._next_rid = first_rid + appended
+            return range(first_rid, self._next_rid)
+
     def _get_page_range_index_of_rid(self, rid: int) -> int:
         assert rid >= 0, \
             "RID out of range: " + str(rid)
@@ -101,12 +124,34 @@ class Table:
         page_range = self._get_page_range_of_rid(rid)
         return page_range.read_record(rid)
 
-    def read_record(self, rid: int) -> Record:
-        raw_record = self.read_raw_record(rid)
-        # check if record has been deleted?
-        columns = raw_record[METADATA_COLUMN_COUNT:]
+    # query_columns holds a 1 for every column to read, the others are left as None. Only the
+    # requested columns are read, a deleted record raises InvalidRIDException
+    def read_record(self, rid: int, query_columns: Sequence[int] = None) -> Record:
+        page_range = self._get_page_range_of_rid(rid)
+        if query_columns is None or all(query_columns):
+            return Record(rid, self.key, page_range.read_columns(rid, range(METADATA_COLUMN_COUNT, METADATA_COLUMN_COUNT + self.num_columns)))
+        projected = [i for i, query in enumerate(query_columns) if query]
+        columns = [None] * self.num_columns
+        values = page_range.read_columns(rid, [i + METADATA_COLUMN_COUNT for i in projected])
+        for i, value in zip(projected, values):
+            columns[i] = value
         return Record(rid, self.key, columns)
 
+    # returns (rid, values of the data columns in column_indices) for every record of rids that
+    # is not deleted, in the order of rids, reading each page once
+    def read_columns_many(self, rids: Sequence[int], column_indices: Sequence[int]) -> List[Tuple[int, List[int]]]:
+        column_indices = [column_index + METADATA_COLUMN_COUNT for column_index in column_indices]
+        rids_by_range = {}
+        for i, rid in enumerate(rids):
+            rids_by_range.setdefault(self._get_page_range_index_of_rid(rid), []).append(i)
+        results = [None] * len(rids)
+        for page_range_index, positions in rids_by_range.items():
+            range_rids = [rids[i] for i in positions]
+            values = self._page_ranges[page_range_index].read_columns_many(range_rids, column_indices)
+            for i, record_values in zip(positions, values):
+                results[i] = record_values
+        return [(rid, values) for rid, values in zip(rids, results) if values is not None]
+
     def delete_record(self, rid: int) -> None:
         page_range = self._get_page_range_of_rid(rid)
         page_range.delete_record(rid)
@@ -126,9 +171,16 @@ class Table:
             if updated_base_page_indices[base_page_num]:
                 self.page_directory.update_version_number(page_range_index, base_page_num)
 
+    # restores the version of rid before its last update, and the indexes with it
     def undo_update(self, rid: int) -> None:
         page_range = self._get_page_range_of_rid(rid)
+        updated_columns = self.read_record(rid).columns
         page_range.undo_update(rid)
+        restored_columns = self.read_record(rid).columns
+        for column, (updated, restored) in enumerate(zip(updated_columns, restored_columns)):
+            if updated != restored:
+                self.index.move_rid(column, updated, rid, restored)
+        self.index.update_composite(rid, updated_columns, restored_columns)
 
     def get_field(self, column_index: int, rid: int) -> int:
         page_range = self._get_page_range_of_rid(rid)
@@ -138,6 +190,33 @@ class Table:
         for page_range in self._page_ranges:
             yield from page_range.get_column(column_index + METADATA_COLUMN_COUNT)
 
+    # yields (value, rid) for every record that is not deleted
+    def get_column_with_rids(self, column_index: int) -> Iterator[Tuple[int, int]]:
+        for page_range in self._page_ranges:
+            yield from page_range.get_column_with_rids(column_index + METADATA_COLUMN_COUNT)
+
+    # yields (rid, values of column_indices) for every record that is not deleted, reading each
+    # base page and the tail pages holding its updates once
+    def get_rows_with_rids(self, column_indices: Sequence[int]) -> Iterator[Tuple[int, List[int]]]:
+        column_indices = [RID_COLUMN] + [column_index + METADATA_COLUMN_COUNT for column_index in column_indices]
+        for page_range in self._page_ranges:
+            for columns in page_range.scan_columns(column_indices, RID_COLUMN, 0, NULL_VALUE - 1):
+                for rid, *values in zip(*columns):
+                    yield rid, values
+
+    # yields (value, rid) for every record whose value in column_index lies in [low, high],
+    # skipping base pages whose zone maps rule the range out
+    def scan_range(self, column_index: int, low: int, high: int) -> Iterator[Tuple[int, int]]:
+        for page_range in self._page_ranges:
+            yield from page_range.scan_range(column_index + METADATA_COLUMN_COUNT, low, high)
+
+    # yields per base page one list of current values per column in column_indices, for the
+    # records whose value in predicate_column lies in [low, high]
+    def scan_columns(self, column_indices: Sequence[int], predicate_column: int, low: int, high: int) -> Iterator[List[List[int]]]:
+        column_indices = [column_index + METADATA_COLUMN_COUNT for column_index in column_indices]
+        for page_range in self._page_ranges:
+            yield from page_range.scan_columns(column_indices, predicate_column + METADATA_COLUMN_COUNT, low, high)
+
     def get_metadata_column(self, column_index: int) -> Iterator[int]:
         assert column_index in range(METADATA_COLUMN_COUNT), \
                 "column_index out of range: " + str(column_index)
@@ -152,7 +231,8 @@ class Table:
     def read_table_from_dir(cls, path):
         metadata_file_path = path / "metadata.txt"
         with metadata_file_path.open() as metadata_file:
-            metadata = metadata_file.readline().split()
+            metadata_text = metadata_file.read()
+            metadata = metadata_text.split("\n")[0].split()
             name = path.name
             num_columns = int(metadata[0])
             key = int(metadata[1])
@@ -160,7 +240,7 @@ class Table:
         table = Table(name, num_columns, key, path, next_rid)
         table.page_directory = PageDirectory.read_from_dir(path)
         table._create_page_ranges_from_files()
-        table.index.create_index(key)
+        table.index.read_from_dir(path, metadata_text)
         return table
 
     def _get_table_metadata_str(self):
@@ -205,15 +285,17 @@ class Table:
 
     def close(self):
         metadata_file_path = self.path / "metadata.txt"
+        metadata_text = self._get_table_metadata_str() + "\n"
+        for page_range in self._page_ranges:
+            range_metadata = page_range.get_metadata()
+            range_metadata_str = " ".join(map(str, range_metadata))
+            metadata_text += range_metadata_str + "\n"
         with metadata_file_path.open(mode="w") as metadata_file:
-            metadata_file.write(self._get_table_metadata_str())
-            metadata_file.write("\n")
-            for page_range in self._page_ranges:
-                range_metadata = page_range.get_metadata()
-                range_metadata_str = " ".join(map(str, range_metadata))
-                metadata_file.write(range_metadata_str)
-                metadata_file.write("\n")
+            metadata_file.write(metadata_text)
+        for page_range in self._page_ranges:
+            page_range.write_zone_maps()
         self.page_directory.write_to_dir(self.path)
+        self.index.write_to_dir(self.path, metadata_text)
 
     def _merge(self):
         while True:
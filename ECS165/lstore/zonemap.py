@@ -0,0 +1,122 @@
+import os
+from array import array
+from pathlib import Path
+
+from lstore.config import *
+from lstore.page import SWAP_BYTES
+
+
+# Min and max of every data column over the records of one base page, along with how many
+# records the page holds and how many of them are deleted. Updates only ever widen the
+# bounds, so they always contain the current values of the page's records, merges tighten
+# them again. An empty page has every min above its max.
+class ZoneMap:
+
+    def __init__(self, num_columns):
+        self.num_records = 0
+        self.num_deleted = 0
+        self.mins = [NULL_VALUE] * num_columns
+        self.maxs = [0] * num_columns
+
+    def append(self, column_values):
+        self.num_records += 1
+        self.widen(column_values)
+
+    # columns holds one list of values per data column, all of the same length
+    def append_many(self, columns):
+        self.num_records += len(columns[0])
+        for i, column in enumerate(columns):
+            self.mins[i] = min(self.mins[i], min(column))
+            self.maxs[i] = max(self.maxs[i], max(column))
+
+    # NULL_VALUE marks a column that is left unchanged
+    def widen(self, column_values):
+        for i, value in enumerate(column_values):
+            if value != NULL_VALUE:
+                if value < self.mins[i]:
+                    self.mins[i] = value
+                if value > self.maxs[i]:
+                    self.maxs[i] = value
+
+    def union(self, other):
+        for i in range(len(self.mins)):
+            self.mins[i] = min(self.mins[i], other.mins[i])
+            self.maxs[i] = max(self.maxs[i], other.maxs[i])
+
+    # false only if no live record of the page can have a value in [low, high] in column
+    def might_contain(self, column, low, high):
+        if self.num_deleted >= self.num_records:
+            return False
+        return self.mins[column] <= high and self.maxs[column] >= low
+
+    def to_values(self):
+        return [self.num_records, self.num_deleted] + self.mins + self.maxs
+
+    @classmethod
+    def from_values(cls, values, num_columns):
+        zone_map = cls(num_columns)
+        zone_map.num_records = values[0]
+        zone_map.num_deleted = values[1]
+        zone_map.mins = list(values[2:2 + num_columns])
+        zone_map.maxs = list(values[2 + num_columns:2 + 2 * num_columns])
+        return zone_map
+
+    # zone map of a base page read from disk, without its deleted count
+    @classmethod
+    def from_base_page(cls, base_page, num_columns):
+        zone_map = cls(num_columns)
+        zone_map.num_records = base_page.get_num_records()
+        if zone_map.num_records:
+            for i in range(num_columns):
+                values = base_page.get_page(i + METADATA_COLUMN_COUNT).as_array()
+                zone_map.mins[i] = min(values)
+                zone_map.maxs[i] = max(values)
+        return zone_map
+
+
+# Zone map files hold a header of magic, a stamp of the page range metadata they were written
+# with and the column count, then for each base page a flag telling whether its zone map is
+# known followed by the values of ZoneMap.to_values, as big endian 64 bit values.
+ZONE_MAP_FILE_MAGIC = int.from_bytes(b"LSTORZMP", "big")
+
+def write_zone_maps(file_path, stamp, num_columns, zone_maps):
+    values = array('Q', [ZONE_MAP_FILE_MAGIC, len(stamp)] + list(stamp) + [num_columns])
+    empty = [0] * (2 + 2 * num_columns)
+    for zone_map in zone_maps:
+        if zone_map is None:
+            values.append(0)
+            values.extend(empty)
+        else:
+            values.append(1)
+            values.extend(zone_map.to_values())
+    if SWAP_BYTES:
+        values.byteswap()
+    file_path = Path(file_path)
+    temp_path = file_path.with_suffix(".tmp")
+    with temp_path.open('wb') as zone_map_file:
+        values.tofile(zone_map_file)
+    os.replace(temp_path, file_path)
+
+# returns num_pages zone maps, unknown ones as None, or None if the file is missing or stale
+def read_zone_maps(file_path, stamp, num_columns, num_pages):
+    file_path = Path(file_path)
+    if not file_path.exists():
+        return None
+    data = file_path.read_bytes()
+    if len(data) % TYPE_SIZE:
+        return None
+    values = array('Q')
+    values.frombytes(data)
+    if SWAP_BYTES:
+        values.byteswap()
+    header = [ZONE_MAP_FILE_MAGIC, len(stamp)] + list(stamp) + [num_columns]
+    entry_length = 3 + 2 * num_columns
+    if list(values[:len(header)]) != header or len(values) != len(header) + num_pages * entry_length:
+        return None
+    zone_maps = []
+    for offset in range(len(header), len(values), entry_length):
+        if values[offset]:
+            zone_maps.append(ZoneMap.from_values(values[offset + 1:offset + entry_length], num_columns))
+        else:
+            zone_maps.append(None)
+    return zone_maps
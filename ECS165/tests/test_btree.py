@@ -0,0 +1,68 @@
+import random
+import threading
+
+# lstore.index imports lstore.table, which has to be imported first
+import lstore.table
+from lstore.index import BTree
+
+
+THREADS = 8
+OPERATIONS = 4000
+KEYS = 5000
+
+
+# Each thread inserts, moves and removes its own rids under keys shared by all threads, so
+# leaves split and are changed by several writers at once. Every thread keeps the key of each
+# of its rids in a reference dict and checks its own rids in the tree as it goes.
+def test_concurrent_insert_move_remove(fast_switching):
+    tree = BTree()
+    references = [{} for _ in range(THREADS)]
+    errors = []
+
+    def work(thread):
+        rng = random.Random(thread)
+        reference = references[thread]
+        next_rid = thread
+        try:
+            for _ in range(OPERATIONS):
+                choice = rng.random()
+                if choice < 0.5 or not reference:
+                    rid, key = next_rid, rng.randrange(KEYS)
+                    next_rid += THREADS
+                    tree.insert_to_tree([key, [rid]])
+                    reference[rid] = key
+                elif choice < 0.8:
+                    rid = rng.choice(list(reference))
+                    old_key, key = reference[rid], rng.randrange(KEYS)
+                    tree.move_rid(old_key, rid, key)
+                    if old_key != key:
+                        assert rid not in (tree.search_tree(old_key) or ())
+                    reference[rid] = key
+                else:
+                    rid = rng.choice(list(reference))
+                    key = reference.pop(rid)
+                    tree.remove_rid(key, rid)
+                    assert rid not in (tree.search_tree(key) or ())
+                    continue
+                assert rid in tree.search_tree(key)
+        except BaseException as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=work, args=(thread,)) for thread in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+    expected = {}
+    for reference in references:
+        for rid, key in reference.items():
+            expected.setdefault(key, set()).add(rid)
+    items = [(key, set(rids)) for key, rids in tree.items()]
+    assert items == sorted(expected.items())
+    for key in range(KEYS):
+        assert set(tree.search_tree(key) or ()) == expected.get(key, set())
+    begin, end = KEYS // 3, KEYS // 2
+    assert [(key, set(rids)) for key, rids in tree.range_search(begin, end)] == \
+        sorted((key, rids) for key, rids in expected.items() if begin <= key <= end)
@@ -0,0 +1,186 @@
+import random
+import threading
+
+import pytest
+
+from lstore.index import BTree, HashIndex
+from lstore.query import Query
+
+
+# runs each target on its own thread and raises the first exception any of them raised
+def run_threads(*targets):
+    errors = []
+
+    def run(target):
+        try:
+            target()
+        except BaseException as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+# batches large enough to rebuild the key's B-tree must not lose keys inserted meanwhile
+def test_insert_many_rebuild_keeps_concurrent_inserts(db, fast_switching):
+    table = db.create_table("Rebuild", 2, 0)
+    query = Query(table)
+    assert query.insert_columns(list(range(100)), [0] * 100)
+    table.index.locate_range(0, 100, 0)
+    assert isinstance(table.index.indices[0], BTree)
+
+    def insert_one_by_one():
+        for key in range(100000, 104000):
+            assert query.insert(key, 1)
+
+    def insert_batches():
+        for start in range(1000, 41000, 4000):
+            assert query.insert_columns(list(range(start, start + 4000)), [2] * 4000)
+
+    run_threads(insert_one_by_one, insert_batches)
+    keys = list(range(100)) + list(range(1000, 41000)) + list(range(100000, 104000))
+    missing = [key for key in keys if not table.index.locate(0, key)]
+    assert missing == []
+
+
+# converting the key's index to a B-tree for a range query must not lose keys inserted meanwhile
+def test_convert_index_keeps_concurrent_inserts(db, fast_switching):
+    table = db.create_table("Convert", 2, 0)
+    query = Query(table)
+    # set once the inserts are under way, or if the inserter failed before that
+    inserting = threading.Event()
+
+    def insert_one_by_one():
+        try:
+            for key in range(40000):
+                assert query.insert(key, key % 7)
+                if key == 1000:
+                    inserting.set()
+        finally:
+            inserting.set()
+
+    def convert_repeatedly():
+        assert inserting.wait(timeout=60), "inserter never started"
+        for _ in range(8):
+            table.index.create_index(0, HashIndex)
+            table.index.locate_range(0, 40000, 0)
+            assert isinstance(table.index.indices[0], BTree)
+
+    run_threads(insert_one_by_one, convert_repeatedly)
+    missing = [key for key in range(40000) if not table.index.locate(0, key)]
+    assert missing == []
+    assert query.sum(0, 39999, 1) == sum(key % 7 for key in range(40000))
+
+
+# random inserts, removes and moves of rids checked against a dict of sets of rids per key
+@pytest.mark.parametrize("index_type", [BTree, HashIndex])
+def test_insert_remove_move_match_reference(index_type):
+    rng = random.Random(11)
+    index = index_type()
+    reference = {}
+    keys = {}
+    for rid in range(20000):
+        choice = rng.random()
+        if choice < 0.4 or not keys:
+            key = rng.randrange(2000)
+            index.insert_to_tree([key, [rid]])
+            reference.setdefault(key, set()).add(rid)
+            keys[rid] = key
+            continue
+        if choice < 0.8:
+            moved = rng.choice(list(keys))
+            key, new_key = keys[moved], rng.randrange(2000)
+            index.move_rid(key, moved, new_key)
+            reference[key].discard(moved)
+            reference.setdefault(new_key, set()).add(moved)
+            keys[moved] = new_key
+        else:
+            removed = rng.choice(list(keys))
+            key = keys.pop(removed)
+            index.remove_rid(key, removed)
+            reference[key].discard(removed)
+        if not reference[key]:
+            del reference[key]
+        looked_up = rng.randrange(2000)
+        assert set(index.search_tree(looked_up) or ()) == reference.get(looked_up, set())
+    assert {key: set(rids) for key, rids in index.items()} == reference
+
+
+# a composite index built while records are inserted must hold every one of them
+def test_create_composite_index_keeps_concurrent_inserts(db, fast_switching):
+    table = db.create_table("Composite", 3, 0)
+    query = Query(table)
+    assert query.insert_columns(list(range(5000)), [key % 50 for key in range(5000)], list(range(5000)))
+    inserting = threading.Event()
+
+    def insert_one_by_one():
+        try:
+            for key in range(5000, 30000):
+                assert query.insert(key, key % 50, key)
+                if key == 6000:
+                    inserting.set()
+        finally:
+            inserting.set()
+
+    def create_composite_index():
+        assert inserting.wait(timeout=60), "inserter never started"
+        table.index.create_composite_index((1,), (2,))
+
+    run_threads(insert_one_by_one, create_composite_index)
+    for value in range(50):
+        records = query.select(value, 1, [0, 1, 1])
+        assert sorted(record.columns[2] for record in records) == list(range(value, 30000, 50))
+
+
+# lookups hand out snapshots, so iterating them while inserts add rids to the key is safe
+@pytest.mark.parametrize("index_type", [BTree, HashIndex])
+def test_search_tree_returns_snapshot(fast_switching, index_type):
+    index = index_type.build([[0, range(1000)]], 0.5)
+    inserting = threading.Event()
+
+    def insert_one_by_one():
+        try:
+            for rid in range(1000, 20000):
+                index.insert_to_tree([0, (rid,)])
+                inserting.set()
+        finally:
+            inserting.set()
+
+    def iterate_rids():
+        assert inserting.wait(timeout=60), "inserter never started"
+        count = 0
+        while count < 20000:
+            count = sum(1 for _ in index.search_tree(0))
+
+    run_threads(insert_one_by_one, iterate_rids)
+    assert list(index.search_tree(0)) == list(range(20000))
+
+
+# covered selects must not iterate the composite index's rid set while inserts add to it
+def test_covered_select_alongside_inserts(db, fast_switching):
+    table = db.create_table("Covered", 3, 0)
+    query = Query(table)
+    assert query.insert_columns(list(range(2000)), [0] * 2000, list(range(2000)))
+    table.index.create_composite_index((1,), (2,))
+    inserting = threading.Event()
+
+    def insert_one_by_one():
+        try:
+            for key in range(2000, 12000):
+                assert query.insert(key, 0, key)
+                inserting.set()
+        finally:
+            inserting.set()
+
+    def select_covered():
+        assert inserting.wait(timeout=60), "inserter never started"
+        while len(query.select(0, 1, [0, 0, 1])) < 12000:
+            pass
+
+    run_threads(insert_one_by_one, select_covered)
+    assert sorted(record.columns[2] for record in query.select(0, 1, [0, 0, 1])) == list(range(12000))
@@ -0,0 +1,135 @@
+import os
+
+import pytest
+
+from lstore.bufferpool import BufferPool
+from lstore.db import Database
+from lstore.pagestore import FilePageStore, MappedSegment, MmapPageStore, PageSegment, SegmentPageStore, \
+    convert_database_to_segments
+from lstore.query import Query
+
+PAGE = 64
+
+
+def page(value):
+    return bytes([value]) * PAGE
+
+
+def test_mapped_segment_reads_back_after_reopen(tmp_path):
+    segment = MappedSegment(tmp_path / "0.seg")
+    for slot in (0, 2, 9):
+        segment.write(slot, page(slot + 1))
+    segment.close()
+    segment = MappedSegment(tmp_path / "0.seg")
+    for slot in (0, 2, 9):
+        assert bytes(segment.read(slot)) == page(slot + 1)
+    segment.close()
+
+
+# slots inside the grown file that were never written are not pages
+def test_mapped_segment_rejects_unwritten_slots(tmp_path):
+    segment = MappedSegment(tmp_path / "0.seg")
+    segment.write(0, page(1))
+    with pytest.raises(AssertionError):
+        segment.read(1)
+    with pytest.raises(AssertionError):
+        segment.read(1000)
+    segment.close()
+    segment = MappedSegment(tmp_path / "0.seg")
+    with pytest.raises(AssertionError):
+        segment.read(1)
+    segment.close()
+
+
+def test_mapped_segment_closes_replaced_mappings(tmp_path):
+    segment = MappedSegment(tmp_path / "0.seg")
+    segment.write(0, page(1))
+    view = segment.read(0)
+    segment.write(100, page(2))
+    # the old mapping is still used by view, so it is only closed once view is released
+    assert len(segment._retired_mmaps) == 1
+    assert bytes(view) == page(1)
+    view.release()
+    segment.write(1000, page(3))
+    assert segment._retired_mmaps == []
+    segment.close()
+
+
+def test_mmap_store_flush_writes_the_file(tmp_path):
+    (tmp_path / "group").mkdir()
+    store = MmapPageStore()
+    store.write(tmp_path, "group", (3, 0), page(7))
+    store.flush()
+    data = (tmp_path / "group" / "0.seg").read_bytes()
+    assert page(7) in data
+    assert bytes(store.read_range(tmp_path, "group", (3, 0), 8, 8)) == page(7)[:8]
+    store.close()
+
+
+def test_page_segment_reopens_from_its_page_table(tmp_path):
+    segment = PageSegment(tmp_path / PageSegment.FILE_NAME)
+    for i in range(5):
+        segment.write("group", (i, 0), page(i))
+    segment.write("group", (2, 0), page(9))
+    segment.close()
+    segment = PageSegment(tmp_path / PageSegment.FILE_NAME)
+    assert segment._page_table_written
+    assert [segment.read("group", (i, 0)) for i in range(5)] == [page(0), page(1), page(9), page(3), page(4)]
+    # pages appended after a page table are found by scanning when the segment is not closed
+    segment.write("group", (5, 0), page(5))
+    os.close(segment._fd)
+    segment = PageSegment(tmp_path / PageSegment.FILE_NAME)
+    assert not segment._page_table_written
+    assert segment.read("group", (5, 0)) == page(5)
+    assert segment.read("group", (2, 0)) == page(9)
+    segment.close()
+
+
+def test_page_segment_truncates_a_torn_block(tmp_path):
+    path = tmp_path / PageSegment.FILE_NAME
+    segment = PageSegment(path)
+    segment.write("group", (0, 0), page(1))
+    segment.write("group", (1, 0), page(2))
+    end = segment._end
+    os.close(segment._fd)
+    # a crash while appending leaves part of a block at the end of the file
+    with path.open("ab") as segment_file:
+        segment_file.write(segment._encode_block_header("group", (2, 0), PAGE) + page(3)[:10])
+    segment = PageSegment(path)
+    assert path.stat().st_size == end
+    assert segment.read("group", (1, 0)) == page(2)
+    with pytest.raises(AssertionError):
+        segment.read("group", (2, 0))
+    segment.write("group", (2, 0), page(3))
+    segment.close()
+    segment = PageSegment(path)
+    assert segment.read("group", (2, 0)) == page(3)
+    segment.close()
+
+
+# converts a database written one file per page and reopens it on the segment store
+def test_convert_database_to_segments(tmp_path):
+    path = tmp_path / "db"
+    original_store = BufferPool.page_store
+    try:
+        BufferPool.page_store = FilePageStore()
+        db = Database()
+        db.open(path)
+        query = Query(db.create_table("Convert", 3, 0))
+        for key in range(2000):
+            assert query.insert(key, key % 10, 0)
+        for key in range(0, 2000, 3):
+            assert query.update(key, None, None, key)
+        db.close()
+        convert_database_to_segments(path)
+        BufferPool.page_store = SegmentPageStore()
+        for _ in range(2):
+            db = Database()
+            db.open(path)
+            query = Query(db.get_table("Convert"))
+            for key in range(2000):
+                expected = [key, key % 10, key if key % 3 == 0 else 0]
+                assert query.select(key, 0, [1, 1, 1])[0].columns == expected
+            db.close()
+    finally:
+        BufferPool.page_store = original_store
@@ -0,0 +1,37 @@
+import pytest
+
+from lstore.bufferpool import PinnableBasePage
+from lstore.pool import ClockPool, ClockProPool, LRUPool, TwoQueuePool
+
+PATH = "table/0"
+
+
+def fill(pool, size):
+    pages = [PinnableBasePage(None) for _ in range(size)]
+    for i, page in enumerate(pages):
+        pool.add_frame(page, (i, 0), PATH, True)
+    return pages
+
+
+@pytest.mark.parametrize("pool_type", [LRUPool, ClockPool, ClockProPool, TwoQueuePool])
+def test_evicts_only_unpinned_frames(pool_type):
+    pool = pool_type(4)
+    pages = fill(pool, 4)
+    for page in pages[:3]:
+        page.try_pin()
+    victim = pool.evict_frame()
+    assert victim.base_page is pages[3]
+    assert pool.get_frame((3, 0), PATH, True) is None
+    assert pool.get_frame((0, 0), PATH, True) is pages[0]
+
+
+# hits set reference bits without the latch, a sweep must still end with a victim
+# when they are set again as fast as the hand clears them
+@pytest.mark.parametrize("pool_type", [ClockPool, ClockProPool])
+def test_clock_evicts_while_hits_keep_setting_bits(pool_type):
+    pool = pool_type(4)
+    pages = fill(pool, 4)
+    pool._is_victim = lambda slot: False
+    victim = pool.evict_frame()
+    assert victim is not None and victim.base_page in pages
+    assert not pool.is_full()
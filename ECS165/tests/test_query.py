@@ -0,0 +1,55 @@
+import pytest
+
+from lstore.index import CompositeIndex
+from lstore.query import Query
+
+
+# records of key 0..999 with column 1 = 0 and column 2 = key, indexed on column 1 covering column 2
+@pytest.fixture
+def query(db):
+    table = db.create_table("Cursor", 3, 0)
+    query = Query(table)
+    assert query.insert_columns(list(range(1000)), [0] * 1000, list(range(1000)))
+    table.index.create_index(1)
+    return query
+
+
+def test_select_cursor_rejects_non_positive_batch_size(query):
+    for batch_size in (0, -1):
+        with pytest.raises(AssertionError, match="batch_size must be positive"):
+            query.select_cursor(0, 1, [1, 1, 1], batch_size)
+
+
+@pytest.mark.parametrize("covered", [False, True])
+def test_select_cursor_matches_select(query, covered):
+    if covered:
+        query.table.index.create_composite_index((1,), (2,))
+    batches = list(query.select_cursor(0, 1, [0, 1, 1], 300))
+    assert [len(batch) for batch in batches] == [300, 300, 300, 100]
+    records = [record for batch in batches for record in batch]
+    assert [(record.rid, record.columns) for record in records] == \
+        [(record.rid, record.columns) for record in query.select(0, 1, [0, 1, 1])]
+
+
+# a cursor reads the records of a batch when the batch is taken, not all of them up front
+def test_select_cursor_reads_per_batch(query, monkeypatch):
+    reads = []
+    read_columns_many = query.table.read_columns_many
+    monkeypatch.setattr(query.table, "read_columns_many",
+                        lambda rids, column_indices: reads.append(len(rids)) or read_columns_many(rids, column_indices))
+    cursor = query.select_cursor(0, 1, [1, 1, 1], 100)
+    next(cursor)
+    assert reads == [100]
+
+    query.table.index.create_composite_index((1,), (2,))
+    covered_reads = []
+    read = CompositeIndex.read
+    monkeypatch.setattr(CompositeIndex, "read",
+                        lambda self, rid, key, query_columns: covered_reads.append(rid) or read(self, rid, key, query_columns))
+    cursor = query.select_cursor(0, 1, [0, 1, 1], 100)
+    next(cursor)
+    assert len(covered_reads) == 100
+    # records deleted after the cursor located them are skipped
+    for key in range(100, 200):
+        assert query.delete(key)
+    assert [record.columns[2] for record in next(cursor)] == list(range(200, 300))
@@ -0,0 +1,78 @@
+import random
+
+from lstore.config import MAX_RECORDS
+from lstore.query import Query
+from lstore.transaction import Transaction
+
+
+# runs an update in a transaction that then aborts on a select of a key that does not exist
+def abort_update(query, key, *columns):
+    transaction = Transaction()
+    transaction.add_query(query.update, key, *columns)
+    transaction.add_query(query.select, -1, 0, [1, 1, 1])
+    assert transaction.run() is False
+
+
+def test_abort_restores_composite_index(db):
+    table = db.create_table("Composite", 3, 0)
+    query = Query(table)
+    assert query.insert(1, 5, 5)
+    table.index.create_composite_index((1,), (2,))
+    abort_update(query, 1, None, 99, 77)
+    assert query.select(1, 0, [1, 1, 1])[0].columns == [1, 5, 5]
+    assert [record.columns for record in query.select(5, 1, [0, 1, 1])] == [[None, 5, 5]]
+    assert query.select(99, 1, [0, 1, 1]) is False
+
+
+def test_abort_restores_secondary_index(db):
+    table = db.create_table("Secondary", 3, 0)
+    query = Query(table)
+    assert query.insert(1, 5, 5)
+    table.index.create_index(1)
+    abort_update(query, 1, None, 99, 77)
+    assert [record.columns for record in query.select(5, 1, [1, 1, 1])] == [[1, 5, 5]]
+    assert query.select(99, 1, [1, 1, 1]) is False
+
+
+# random committed and aborted updates checked against a dict of sets of keys per value
+def test_updates_and_aborts_match_reference(db):
+    rng = random.Random(7)
+    table = db.create_table("Random", 3, 0)
+    query = Query(table)
+    rows = {key: [key, rng.randrange(20), rng.randrange(20)] for key in range(300)}
+    for row in rows.values():
+        assert query.insert(*row)
+    table.index.create_index(1)
+    table.index.create_index(2)
+    for _ in range(2000):
+        key = rng.randrange(300)
+        update = [None, rng.randrange(20), None] if rng.random() < 0.5 else [None, None, rng.randrange(20)]
+        if rng.random() < 0.5:
+            abort_update(query, key, *update)
+        else:
+            assert query.update(key, *update)
+            rows[key] = [old if new is None else new for old, new in zip(rows[key], update)]
+    for column in (1, 2):
+        reference = {}
+        for key, row in rows.items():
+            reference.setdefault(row[column], set()).add(key)
+        for value in range(20):
+            records = query.select(value, column, [1, 1, 1]) or []
+            assert {record.columns[0] for record in records} == reference.get(value, set())
+            assert all(record.columns == rows[record.columns[0]] for record in records)
+
+
+# a merge after an aborted update tightens the zone maps from the committed values only
+def test_merge_ignores_aborted_update(db):
+    table = db.create_table("Merge", 3, 0)
+    query = Query(table)
+    assert query.insert_columns(list(range(MAX_RECORDS)), [5] * MAX_RECORDS, [5] * MAX_RECORDS)
+    assert query.update(1, None, 6, None)
+    abort_update(query, 2, None, 99, None)
+    page_range = table._page_ranges[0]
+    page_range.merge()
+    zone_map = page_range._zone_maps[0]
+    assert (zone_map.mins[1], zone_map.maxs[1]) == (5, 6)
+    assert not zone_map.might_contain(1, 99, 99)
+    assert [rid for _, rid in table.scan_range(1, 99, 99)] == []
+    assert query.select(2, 0, [1, 1, 1])[0].columns == [2, 5, 5]